@@ -0,0 +1,227 @@
+"""
+Recent activity lists: short, capped lists of object ids, newest first,
+such as the "<forum>-latest-threads" list behind ThreadList.active_threads.
+
+The storage is pluggable through FORUM_ACTIVITY_BACKEND:
+
+  forum.activity.EnuffActivityList     Redis lists, the default when enuff is installed
+  forum.activity.CacheActivityList     the "forum" cache, or the default one
+  forum.activity.DatabaseActivityList  a ring buffer in the RecentActivity table
+  forum.activity.LocMemActivityList    an LRU in process memory
+
+Every backend caps a list at the trim of each push, reads at most limit
+entries and can be refilled from the database with forum_rebuild_activity.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+try:
+    from enuff.backends.redis import RedisBackend
+except ImportError:
+    RedisBackend = None
+
+FORUM_ACTIVITY_BACKEND = getattr(settings, 'FORUM_ACTIVITY_BACKEND', 'forum.activity.EnuffActivityList'
+                                 if RedisBackend else 'forum.activity.CacheActivityList')
+FORUM_ACTIVITY_CACHE_TIMEOUT = getattr(settings, 'FORUM_ACTIVITY_CACHE_TIMEOUT', None)
+FORUM_ACTIVITY_LOCMEM_LISTS = getattr(settings, 'FORUM_ACTIVITY_LOCMEM_LISTS', 1000)
+
+
+class BaseActivityList(object):
+    def push(self, key, object_id, trim):
+        """ Moves object_id to the front of key, keeping trim entries. """
+        raise NotImplementedError
+
+    def get(self, key, limit):
+        """ The newest limit ids of key. """
+        raise NotImplementedError
+
+    def replace(self, key, ids):
+        """ Replaces the content of key with ids, newest first. """
+        raise NotImplementedError
+
+
+class EnuffActivityList(BaseActivityList):
+    """
+    Stores each list as a Redis list, through the connection of the enuff
+    nonrel store and under the keys Thread.nonrel_objects uses. A push is
+    sent as one MULTI block, so concurrent pushes are never lost.
+    """
+
+    def __init__(self):
+        self.conn = RedisBackend().conn
+
+    def _key(self, key):
+        return '::'.join(['forum', 'thread', str(settings.SITE_ID), key])
+
+    def push(self, key, object_id, trim):
+        pipe = self.conn.pipeline()
+        pipe.lrem(self._key(key), 0, object_id)
+        pipe.lpush(self._key(key), object_id)
+        pipe.ltrim(self._key(key), 0, trim - 1)
+        pipe.execute()
+
+    def get(self, key, limit):
+        return [int(i) for i in self.conn.lrange(self._key(key), 0, limit - 1)]
+
+    def replace(self, key, ids):
+        ids = list(ids)
+        pipe = self.conn.pipeline()
+        pipe.delete(self._key(key))
+        if ids:
+            pipe.rpush(self._key(key), *ids)
+        pipe.execute()
+
+
+class CacheActivityList(BaseActivityList):
+    """
+    Stores each list as a single cache value. Pushes read, modify and
+    write the value, so two simultaneous pushes to a list may lose one.
+    """
+
+    def __init__(self):
+        try:
+            self.cache = caches['forum']
+        except InvalidCacheBackendError:
+            self.cache = caches['default']
+
+    def _key(self, key):
+        return 'forum::activity::%s' % key
+
+    def push(self, key, object_id, trim):
+        ids = [i for i in self.cache.get(self._key(key), []) if i != object_id]
+        self.replace(key, [object_id] + ids[:trim - 1])
+
+    def get(self, key, limit):
+        return self.cache.get(self._key(key), [])[:limit]
+
+    def replace(self, key, ids):
+        self.cache.set(self._key(key), list(ids), FORUM_ACTIVITY_CACHE_TIMEOUT)
+
+
+class DatabaseActivityList(BaseActivityList):
+    """
+    Stores each list as at most trim rows of RecentActivity, one per slot.
+    A push restamps the object's row if it is already listed and otherwise
+    fills a free slot or overwrites the oldest one.
+    """
+
+    @property
+    def model(self):
+        from forum.models import RecentActivity
+        return RecentActivity
+
+    def push(self, key, object_id, trim):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                rows = list(self.model.objects.select_for_update().filter(
+                    list=key).order_by('stamp').values_list('pk', 'slot', 'object_id'))
+                listed = [pk for pk, slot, oid in rows if oid == object_id]
+                if listed:
+                    self.model.objects.filter(pk=listed[0]).update(stamp=now)
+                elif len(rows) < trim:
+                    used = set(slot for pk, slot, oid in rows)
+                    slot = min(set(range(trim)) - used)
+                    self.model.objects.create(list=key, slot=slot, object_id=object_id, stamp=now)
+                else:
+                    self.model.objects.filter(pk=rows[0][0]).update(object_id=object_id, stamp=now)
+                if len(rows) > trim:
+                    self.model.objects.filter(list=key, slot__gte=trim).delete()
+        except IntegrityError:
+            # Another push took the same free slot; this entry is dropped.
+            pass
+
+    def get(self, key, limit):
+        return list(self.model.objects.filter(list=key).order_by(
+            '-stamp', '-slot').values_list('object_id', flat=True)[:limit])
+
+    def replace(self, key, ids):
+        now = timezone.now()
+        ids = list(ids)
+        with transaction.atomic():
+            self.model.objects.filter(list=key).delete()
+            self.model.objects.bulk_create([
+                self.model(list=key, slot=slot, object_id=object_id,
+                           stamp=now - timedelta(microseconds=slot))
+                for slot, object_id in enumerate(ids)])
+
+
+class LocMemActivityList(BaseActivityList):
+    """
+    Keeps the lists in this process only: every worker has its own copy
+    and it is empty after a restart until forum_rebuild_activity runs.
+    At most FORUM_ACTIVITY_LOCMEM_LISTS lists are kept, least recently
+    used first out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lists = OrderedDict()
+
+    def push(self, key, object_id, trim):
+        with self._lock:
+            ids = self._lists.pop(key, None) or OrderedDict()
+            ids.pop(object_id, None)
+            ids[object_id] = True
+            while len(ids) > trim:
+                ids.popitem(last=False)
+            self._store(key, ids)
+
+    def get(self, key, limit):
+        with self._lock:
+            ids = self._lists.get(key)
+            if ids is None:
+                return []
+            self._lists.move_to_end(key)
+            newest = []
+            for object_id in reversed(ids):
+                if len(newest) == limit:
+                    break
+                newest.append(object_id)
+            return newest
+
+    def replace(self, key, ids):
+        with self._lock:
+            self._lists.pop(key, None)
+            self._store(key, OrderedDict((object_id, True) for object_id in reversed(list(ids))))
+
+    def _store(self, key, ids):
+        self._lists[key] = ids
+        while len(self._lists) > FORUM_ACTIVITY_LOCMEM_LISTS:
+            self._lists.popitem(last=False)
+
+
+_backend = []
+
+
+def get_activity_list():
+    """ The FORUM_ACTIVITY_BACKEND instance of this process. """
+    if not _backend:
+        _backend.append(import_string(FORUM_ACTIVITY_BACKEND)())
+    return _backend[0]
+
+
+def push(key, object_id, trim):
+    get_activity_list().push(key, object_id, trim)
+
+
+def get_objects(key, queryset, limit):
+    """
+    The objects of queryset listed in key, newest first, fetched with a
+    single id__in query. An id listed twice is returned once, and ids
+    that no longer match queryset are skipped.
+    """
+    ids = list(OrderedDict.fromkeys(get_activity_list().get(key, limit)))
+    if not ids:
+        return []
+    objects = queryset.in_bulk(ids)
+    return [objects[i] for i in ids if i in objects]
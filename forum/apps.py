@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.core.signals import request_started
+
+
+def warm_registry(sender, **kwargs):
+    from forum import registry
+    request_started.disconnect(warm_registry, dispatch_uid='forum.registry.warm')
+    registry.warm()
+
+
+class ForumConfig(AppConfig):
+    name = 'forum'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        # Querying the database from ready() is discouraged (the tables may
+        # not exist yet), so the lookups are warmed by the first request.
+        request_started.connect(warm_registry, dispatch_uid='forum.registry.warm')
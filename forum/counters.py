@@ -0,0 +1,131 @@
+"""
+Buffered counters for hot rows.
+
+Increments are accumulated in process memory and written back with a
+single UPDATE per flush, so readers and posters are not serialized on
+the row lock of a busy thread. Whatever is pending when a process dies
+is lost; FORUM_COUNTER_MAX_PENDING bounds how much that can be.
+"""
+
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import models
+
+
+FORUM_COUNTER_FLUSH_INTERVAL = getattr(settings, 'FORUM_COUNTER_FLUSH_INTERVAL', 10)
+FORUM_COUNTER_MAX_PENDING = getattr(settings, 'FORUM_COUNTER_MAX_PENDING', 100)
+
+_counters = []
+
+
+class BufferedCounter(object):
+    """
+    Accumulates increments of an integer column, keyed by primary key.
+
+    If latest_field is given, it is a foreign key that is moved forward
+    to the highest value passed to incr(), never backwards. on_flush, if
+    given, is called with the primary keys each flush has written.
+    """
+
+    def __init__(self, model, field, latest_field=None, flush_interval=None, max_pending=None,
+                 on_flush=None):
+        self.model = model
+        self.field = field
+        self.latest_field = latest_field
+        self.on_flush = on_flush
+        self.flush_interval = FORUM_COUNTER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_pending = FORUM_COUNTER_MAX_PENDING if max_pending is None else max_pending
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._latest = {}
+        self._total = 0
+        self._last_flush = time.time()
+        _counters.append(self)
+
+    def incr(self, pk, amount=1, latest=None):
+        with self._lock:
+            self._pending[pk] = self._pending.get(pk, 0) + amount
+            self._total += amount
+            if latest is not None and latest > self._latest.get(pk, 0):
+                self._latest[pk] = latest
+            due = (self._total >= self.max_pending or
+                   time.time() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush_due(self):
+        """ Flushes if the interval has elapsed since the last flush. """
+        if self._pending and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def pending(self, pk):
+        """ Increments for pk that have not reached the database yet. """
+        return self._pending.get(pk, 0)
+
+    def flush(self):
+        """
+        Writes every pending increment with one UPDATE. Returns the number
+        of rows touched.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            latest, self._latest = self._latest, {}
+            self._total = 0
+            self._last_flush = time.time()
+        if not pending and not latest:
+            return 0
+
+        values = {}
+        if pending:
+            values[self.field] = models.F(self.field) + models.Case(
+                *[models.When(pk=pk, then=models.Value(amount)) for pk, amount in pending.items()],
+                default=models.Value(0), output_field=models.IntegerField())
+        if latest:
+            behind = models.Q(**{'%s__isnull' % self.latest_field: True})
+            values[self.latest_field] = models.Case(
+                *[models.When(models.Q(pk=pk) & (behind | models.Q(**{'%s__lt' % self.latest_field: value})),
+                              then=models.Value(value)) for pk, value in latest.items()],
+                default=models.F(self.latest_field), output_field=models.IntegerField())
+        pks = set(pending) | set(latest)
+        try:
+            rows = self.model.objects.filter(pk__in=pks).update(**values)
+        except Exception:
+            # Put the increments back so the next flush retries them.
+            with self._lock:
+                for pk, amount in pending.items():
+                    self._pending[pk] = self._pending.get(pk, 0) + amount
+                    self._total += amount
+                for pk, value in latest.items():
+                    self._latest[pk] = max(value, self._latest.get(pk, 0))
+            raise
+        if self.on_flush:
+            self.on_flush(pks)
+        return rows
+
+
+def flush_all():
+    """ Flushes every buffered counter of this process. """
+    return sum(counter.flush() for counter in _counters)
+
+
+def flush_due(sender=None, **kwargs):
+    """
+    Periodic hook, connected to request_started: counters whose interval
+    has elapsed are written even if they received no hits since.
+    """
+    for counter in _counters:
+        counter.flush_due()
+
+request_started.connect(flush_due)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_all()
+    except Exception:
+        pass
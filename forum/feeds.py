@@ -1,24 +1,92 @@
+import hashlib
+
 from django.conf import settings
 from django.contrib.syndication.views import Feed
 from django.contrib.syndication.views import FeedDoesNotExist
 from django.utils.feedgenerator import Atom1Feed
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.sites.models import Site
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Max
+from django.http import Http404, HttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils.translation import gettext as _
 
-from forum.models import Forum, Thread
+from forum.models import Forum, Thread, forum_posts, get_forum_cache, get_generation
+from forum.permissions import get_permissions
+from forum.registry import get_comment_model
+
+FORUM_FEED_CACHE_TIMEOUT = getattr(settings, 'FORUM_FEED_CACHE_TIMEOUT', 60*60*24)
+
 
 class RssForumFeed(Feed):
+    """
+    Latest posts of a forum, or of all forums. Feeds are fetched without
+    a session, so only what an anonymous user can read is listed.
+
+    Responses carry an ETag and Last-Modified taken from the forum's
+    latest_post and last_activity columns, so a poll that has nothing new
+    is answered with 304 from the forum row alone. With a forum cache the
+    rendered XML is kept until a reply moves latest_post or the forum's
+    page generation is bumped.
+    """
     title_template = 'forum/feeds/post_title.html'
     description_template = 'forum/feeds/post_description.html'
 
-    def get_object(self, bits):
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404("Feed object does not exist.")
+
+        if obj:
+            latest_post_id, last_activity = obj.latest_post_id, obj.last_activity
+            generation = get_generation('forum::%s' % obj.slug)
+        else:
+            latest = self.public_forums().aggregate(post=Max('latest_post'), activity=Max('last_activity'))
+            latest_post_id, last_activity = latest['post'], latest['activity']
+            generation = get_generation('index')
+        version = '%s:%s:%s:%s' % (self.__class__.__name__, obj.pk if obj else '', latest_post_id, generation)
+        etag = '"%s"' % hashlib.md5(version.encode('utf-8')).hexdigest()
+        last_modified = int(last_activity.timestamp()) if last_activity else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        cache = get_forum_cache()
+        key = 'forum::feed::%s' % etag.strip('"')
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            content_type, content = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            feedgen = self.get_feed(obj, request)
+            response = HttpResponse(content_type=feedgen.content_type)
+            feedgen.write(response, 'utf-8')
+            if cache:
+                cache.set(key, (response['Content-Type'], response.content), FORUM_FEED_CACHE_TIMEOUT)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_object(self, request, url=''):
+        # url is "rss" or "atom", followed by the forum slug if any.
+        bits = url.split('/')[1:]
         if len(bits) == 0:
             return None
         else:
             slug = "/".join(bits)
-            return Forum.objects.get(slug__exact=slug)
+            forum = Forum.objects.get(slug__exact=slug, site=settings.SITE_ID)
+            if not get_permissions(AnonymousUser()).can_read(forum):
+                raise Http404
+            return forum
+
+    def public_forums(self):
+        return Forum.objects.for_user(AnonymousUser()).filter(restricted=False, site=settings.SITE_ID)
 
     def title(self, obj):
         if not hasattr(self, '_site'):
@@ -41,20 +109,17 @@ class RssForumFeed(Feed):
         if obj:
             return obj.get_absolute_url()
         else:
-            return reverse('forum_index')
+            return reverse('forum_list')
 
     def get_query_set(self, obj):
-        Post = django_comments.get_model()
-        if obj:
-            return Post.objects.filter(thread__forum__pk=obj.id).order_by('-time')
-        else:
-            return Post.objects.order_by('-time')
+        posts = forum_posts([obj] if obj else self.public_forums())
+        return posts.filter(is_public=True, is_removed=False).order_by('-submit_date')
 
     def items(self, obj):
         return self.get_query_set(obj)[:15]
 
     def item_pubdate(self, item):
-        return item.time
+        return item.submit_date
 
 
 class AtomForumFeed(RssForumFeed):
@@ -1,17 +1,12 @@
 import datetime
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import User
-from django.contrib.contenttypes.models import ContentType
 from django import forms
 from django.utils.translation import gettext as _
 from django.utils.safestring import mark_safe
 
 from forum.models import Thread
-
-try:
-    from django.contrib import comments
-except ImportError:
-    import django_comments as comments
+from forum.registry import get_comment_model, thread_content_type_id
 
 
 class ThreadForm(forms.ModelForm):
@@ -72,10 +67,8 @@ class ThreadForm(forms.ModelForm):
         instance.forum = self.forum
         if not instance.comment:
             instance.save()
-            Post = comments.get_model()
-            ct = ContentType.objects.get_for_model(Thread)
-            instance.comment = Post.objects.create(
-                content_type=ct,
+            instance.comment = get_comment_model().objects.create(
+                content_type_id=thread_content_type_id(),
                 object_pk=instance.pk,
                 user=self.user,
                 submit_date=datetime.datetime.now(),
@@ -88,10 +81,8 @@ class ThreadForm(forms.ModelForm):
         instance.comment.save()
         instance.save()
 
-        instance.banned_users.clear()
-        for item in self.cleaned_data.get("banned_users", "").split(","):
-            if item.strip():
-                instance.banned_users.add(User.objects.get(username=item.strip()))
+        names = [item.strip() for item in self.cleaned_data.get("banned_users", "").split(",")]
+        instance.banned_users.set(User.objects.filter(username__in=[name for name in names if name]))
         return instance
 
     class Meta:
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Comment, Thread, ThreadPost
+from forum.registry import thread_content_type_id
+
+
+class Command(BaseCommand):
+    help = "Fill the ThreadPost index for posts made before it existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        posts = Comment.objects.filter(
+            content_type_id=thread_content_type_id(), forum_thread_post__isnull=True).order_by('pk')
+        last_pk, created = 0, 0
+        while True:
+            batch = list(posts.filter(pk__gt=last_pk).values_list(
+                'pk', 'object_pk', 'submit_date')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            threads = set(Thread.objects.filter(
+                pk__in={int(object_pk) for pk, object_pk, date in batch}).values_list('pk', flat=True))
+            rows = [ThreadPost(thread_id=int(object_pk), post_id=pk, submit_date=date)
+                    for pk, object_pk, date in batch if int(object_pk) in threads]
+            ThreadPost.objects.bulk_create(rows, ignore_conflicts=True)
+            created += len(rows)
+            self.stdout.write("Indexed %s posts" % created)
+        self.stdout.write("Done, indexed %s posts." % created)
@@ -0,0 +1,106 @@
+import statistics
+import time
+from importlib import import_module
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from forum.models import Forum, Thread, Comment
+
+
+class Command(BaseCommand):
+    help = """Times the forum's hot queries and prints their query plans.
+
+With --seed, a synthetic "benchmark" forum is filled first. With
+--compare, the queries are run again after dropping the composite
+indexes, which are recreated before the command exits."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of threads to create in the benchmark forum.")
+        parser.add_argument('--posts-per-thread', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Runs per query; the median is reported.")
+        parser.add_argument('--compare', action='store_true',
+                            help="Also time the queries without the composite indexes.")
+
+    def handle(self, *args, **options):
+        forum = Forum.objects.filter(slug='benchmark', site=settings.SITE_ID).first()
+        if forum is None:
+            forum = Forum(slug='benchmark', site_id=settings.SITE_ID, title='Benchmark',
+                          description='Synthetic data for forum_benchmark.')
+            forum.save()
+        if options['seed']:
+            self.seed(forum, options['seed'], options['posts_per_thread'], options['batch_size'])
+
+        thread = forum.thread_set.order_by('id').first()
+        if thread is None:
+            self.stderr.write("The benchmark forum is empty, run with --seed first.")
+            return
+        ct = ContentType.objects.get_for_model(Thread)
+
+        queries = [
+            ("thread list", forum.thread_set.filter(sticky=False).order_by('-id')[:20]),
+            ("sticky threads", forum.thread_set.filter(sticky=True).order_by('-id')),
+            ("thread by slug", Thread.objects.filter(slug=thread.slug, forum__site=settings.SITE_ID)),
+            ("duplicate title", Thread.objects.filter(comment__user=1, title=thread.title)),
+            ("thread posts", Comment.objects.filter(
+                content_type=ct, object_pk=thread.pk).order_by('submit_date')[:20]),
+        ]
+        self.run_queries(queries, options['repeat'])
+        if options['compare']:
+            indexes = self.get_indexes()
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            try:
+                self.stdout.write("\nWithout the composite indexes:")
+                self.run_queries(queries, options['repeat'])
+            finally:
+                with connection.schema_editor() as editor:
+                    for model, index in indexes:
+                        editor.add_index(model, index)
+
+    def get_indexes(self):
+        """ The indexes added by migration 0009, as (model, index) pairs. """
+        comment_index = import_module('forum.migrations.0009_query_indexes').COMMENT_INDEX
+        return [(Thread, index) for index in Thread._meta.indexes] + [(Comment, comment_index)]
+
+    def run_queries(self, queries, repeat):
+        for name, queryset in queries:
+            timings = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write("== %s: %.2f ms median" % (name, statistics.median(timings)))
+            self.stdout.write(queryset.explain())
+
+    def seed(self, forum, count, posts_per_thread, batch_size):
+        site = Site.objects.get_current()
+        ct = ContentType.objects.get_for_model(Thread)
+        start = Thread.objects.filter(forum=forum).count()
+        since = datetime.now() - timedelta(days=365)
+        began = time.perf_counter()
+
+        for offset in range(start, start + count, batch_size):
+            numbers = range(offset, min(offset + batch_size, start + count))
+            Thread.objects.bulk_create([
+                Thread(forum=forum, title='Benchmark thread %s' % i, slug='benchmark-%s' % i,
+                       sticky=not i % 50, posts=posts_per_thread) for i in numbers])
+            ids = Thread.objects.filter(
+                forum=forum, slug__in=['benchmark-%s' % i for i in numbers]).values_list('pk', flat=True)
+            posts = [
+                Comment(content_type=ct, object_pk=str(pk), site=site, comment='Benchmark post.',
+                        submit_date=since + timedelta(seconds=pk * posts_per_thread + n))
+                for pk in ids for n in range(posts_per_thread)]
+            Comment.objects.bulk_create(posts, batch_size=batch_size)
+            self.stdout.write("Seeded %s threads" % (numbers[-1] + 1 - start))
+
+        Forum.objects.adjust_counters(forum.pk, threads=count, posts=count * posts_per_thread)
+        self.stdout.write("Seeded %s threads in %.1fs" % (count, time.perf_counter() - began))
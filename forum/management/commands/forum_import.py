@@ -0,0 +1,182 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from forum.models import Forum, Thread, ThreadPost, bump_generation
+from forum.registry import get_comment_model, thread_content_type_id
+
+
+def flag(value):
+    return value in (True, 1, '1', 'true', 'True')
+
+
+class Command(BaseCommand):
+    help = """Import threads and posts from a JSONL or CSV file.
+
+Every row is one post, with the columns:
+
+  thread        key of the thread in the source data
+  forum         slug of an existing forum
+  title         thread title
+  user          username of the author (optional)
+  comment       the post's text
+  submit_date   ISO 8601 date (optional, defaults to now)
+  sticky, closed, banned_users  (optional, comma separated usernames)
+
+The first row of a thread key opens the thread; forum, title, sticky,
+closed and banned_users are only read from that row. Posts are inserted
+with bulk_create, so no signals fire: the ThreadPost index and the
+thread and forum counters are filled by the command itself, in the
+transaction of each batch. If a batch fails, the batches before it stay
+imported and consistent. Run forum_rebuild_activity afterwards to refill
+the recent activity lists."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError("forum_import needs a database that returns primary keys from bulk inserts.")
+
+        fmt = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        forums = Forum.objects.filter(site=settings.SITE_ID).values_list('slug', 'pk', 'path')
+        self.forums = dict((slug, pk) for slug, pk, path in forums)
+        self.forum_paths = dict((pk, path) for slug, pk, path in forums)
+        self.users = {}
+        self.slugs = set(Thread.objects.values_list('slug', flat=True).iterator())
+        self.threads = {}
+        self.line = 0
+
+        began = time.perf_counter()
+        with open(options['path'], newline='', encoding='utf-8') as f:
+            rows = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    self.update_counters(self.import_batch(batch))
+                bump_generation('forums')
+                self.line += len(batch)
+                self.stdout.write("Imported %s posts (%.0f rows/sec)" % (
+                    self.line, self.line / (time.perf_counter() - began)))
+
+        elapsed = time.perf_counter() - began
+        self.stdout.write("Imported %s posts in %s threads in %.1fs (%.0f rows/sec)." % (
+            self.line, len(self.threads), elapsed, self.line / elapsed if elapsed else 0))
+
+    def error(self, number, message):
+        raise CommandError("Row %s: %s (the first %s rows were imported)" % (
+            self.line + number + 1, message, self.line))
+
+    def make_slug(self, title):
+        """ The slug SlugifyUniquely would pick, from the slugs seen so far. """
+        max_length = Thread._meta.get_field('slug').max_length
+        base = slugify(title)[:max_length] or 'thread'
+        slug, n = base, 0
+        while slug in self.slugs:
+            n += 1
+            suffix = '-%s' % n
+            slug = '%s%s' % (base[:max_length - len(suffix)], suffix)
+        self.slugs.add(slug)
+        return slug
+
+    def resolve_users(self, batch):
+        names = set()
+        for row in batch:
+            names.add(row.get('user') or '')
+            names.update(n.strip() for n in (row.get('banned_users') or '').split(','))
+        names = names.difference(self.users, [''])
+        if names:
+            self.users.update(User.objects.filter(username__in=names).values_list('username', 'pk'))
+            self.users.update((name, None) for name in names.difference(self.users))
+
+    def import_batch(self, batch):
+        """ Inserts the rows of batch, returning the keys of the threads it touched. """
+        Comment = get_comment_model()
+        self.resolve_users(batch)
+
+        new_threads, openers = {}, {}
+        for number, row in enumerate(batch):
+            key = row.get('thread')
+            if not key:
+                self.error(number, "no thread key")
+            if key in self.threads or key in new_threads:
+                continue
+            if row.get('forum') not in self.forums:
+                self.error(number, "unknown forum %r" % row.get('forum'))
+            openers[key] = row
+            new_threads[key] = Thread(
+                forum_id=self.forums[row['forum']], title=row.get('title') or '',
+                slug=self.make_slug(row.get('title') or ''),
+                sticky=flag(row.get('sticky')), closed=flag(row.get('closed')))
+        Thread.objects.bulk_create(new_threads.values())
+
+        now = timezone.now()
+        posts = []
+        for number, row in enumerate(batch):
+            thread = new_threads.get(row['thread'])
+            thread_id = thread.pk if thread else self.threads[row['thread']][0]
+            submit_date = parse_datetime(row['submit_date']) if row.get('submit_date') else now
+            if submit_date is None:
+                self.error(number, "invalid submit_date %r" % row['submit_date'])
+            if settings.USE_TZ and timezone.is_naive(submit_date):
+                submit_date = timezone.make_aware(submit_date)
+            user_id = self.users.get(row.get('user') or '')
+            posts.append(Comment(
+                content_type_id=thread_content_type_id(), object_pk=str(thread_id),
+                site_id=settings.SITE_ID, user_id=user_id,
+                user_name='' if user_id else (row.get('user') or ''),
+                comment=row.get('comment') or '', submit_date=submit_date))
+        Comment.objects.bulk_create(posts)
+
+        for row, post in zip(batch, posts):
+            thread = new_threads.get(row['thread'])
+            if thread and thread.comment_id is None:
+                # The opening post, which Thread.posts does not count.
+                thread.comment_id = post.pk
+                self.threads[row['thread']] = [thread.pk, 0, (post.submit_date, post.pk)]
+                continue
+            state = self.threads[row['thread']]
+            state[1] += 1
+            state[2] = max(state[2], (post.submit_date, post.pk))
+        Thread.objects.bulk_update(new_threads.values(), ['comment'])
+
+        ThreadPost.objects.bulk_create([
+            ThreadPost(thread_id=int(post.object_pk), post_id=post.pk, submit_date=post.submit_date)
+            for post in posts])
+
+        banned = []
+        for key, thread in new_threads.items():
+            names = (openers[key].get('banned_users') or '').split(',')
+            user_ids = set(self.users.get(name.strip()) for name in names)
+            banned.extend(Thread.banned_users.through(thread_id=thread.pk, user_id=user_id)
+                          for user_id in user_ids if user_id)
+        Thread.banned_users.through.objects.bulk_create(banned)
+        return set(row['thread'] for row in batch)
+
+    def update_counters(self, keys):
+        """
+        Sets posts and latest_post of the threads in keys, from everything
+        imported so far, and recomputes the counters of their forums.
+        """
+        states = [self.threads[key] for key in keys]
+        Thread.objects.bulk_update([
+            Thread(pk=pk, posts=posts, latest_post_id=latest[1]) for pk, posts, latest in states],
+            ['posts', 'latest_post'])
+        forum_ids = Thread.objects.filter(pk__in=[state[0] for state in states]).values_list(
+            'forum_id', flat=True).distinct()
+        Forum.objects.rebuild_counters(ids=set(
+            int(i) for forum_id in forum_ids for i in self.forum_paths[forum_id].split('/') if i))
@@ -0,0 +1,41 @@
+from itertools import groupby, islice
+
+from django.core.management.base import BaseCommand
+
+from forum import activity
+from forum.models import Comment, Forum, Thread
+from forum.registry import thread_content_type_id
+
+
+class Command(BaseCommand):
+    help = "Refill the recent activity lists of every forum from the database."
+
+    def handle(self, *args, **options):
+        forums = Forum.objects.all()
+        for forum in forums:
+            threads = forum.thread_set.all()
+            activity.get_activity_list().replace(
+                '%s-latest-threads' % forum.slug,
+                threads.filter(latest_post__isnull=False).order_by(
+                    '-latest_post').values_list('pk', flat=True)[:25])
+            activity.get_activity_list().replace(
+                '%s-latest-comments' % forum.slug,
+                threads.order_by('-id').values_list('pk', flat=True)[:30])
+        activity.get_activity_list().replace(
+            'latest-threads', Thread.objects.filter(latest_post__isnull=False).order_by(
+                '-latest_post').values_list('pk', flat=True)[:50])
+        activity.get_activity_list().replace(
+            'latest-posts', Comment.objects.filter(content_type_id=thread_content_type_id()).order_by(
+                '-submit_date', '-pk').values_list('pk', flat=True)[:50])
+        self.stdout.write("Rebuilt activity lists for %s forums." % len(forums))
+
+        # One pass over all forum posts, newest first per author.
+        posts = Comment.objects.filter(
+            content_type_id=thread_content_type_id(), user__isnull=False).order_by(
+            'user', '-submit_date', '-pk').values_list('user', 'pk').iterator()
+        users = 0
+        for user_id, rows in groupby(posts, key=lambda row: row[0]):
+            activity.get_activity_list().replace(
+                'user-%s-latest-posts' % user_id, [pk for user, pk in islice(rows, 20)])
+            users += 1
+        self.stdout.write("Rebuilt latest posts for %s users." % users)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from forum.models import Forum
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized thread and post counters of every forum."
+
+    def handle(self, *args, **options):
+        updated = Forum.objects.rebuild_counters()
+        self.stdout.write("Rebuilt counters for %s forums." % updated)
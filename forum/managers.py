@@ -1,5 +1,6 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, Count, F, Func, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 
 
 class ForumManager(models.Manager):
@@ -23,3 +24,81 @@ class ForumManager(models.Manager):
                                             hasattr(user, 'userprofile') and
                                             getattr(user.userprofile, 'is_upgraded', False))
         return forum in self.for_user(user)
+
+    def prefetch_ancestors(self, forums):
+        """
+        Fills the get_ancestors() cache of each of forums from one query
+        over the ancestors named in their paths. Returns forums as a list.
+        """
+        forums = list(forums)
+        chains = dict((forum.pk, [int(i) for i in forum.path.split('/') if i][:-1]) for forum in forums)
+        ids = set(i for chain in chains.values() for i in chain)
+        ancestors = self.in_bulk(ids) if ids else {}
+        for forum in forums:
+            forum._ancestors_cache = [ancestors[i] for i in chains[forum.pk] if i in ancestors]
+        return forums
+
+    def adjust_counters(self, forum_id, threads=0, posts=0, last_activity=None, path=None,
+                        latest_post_id=None, latest_thread_id=None):
+        """
+        Atomically shifts the denormalized thread/post counters of a forum
+        and the subtree totals of the forum and all its ancestors, in one
+        UPDATE. last_activity and the latest_post/latest_thread pointers
+        only ever move forward.
+
+        Pass the forum's path if it is at hand to save looking it up.
+        """
+        if not (threads or posts or last_activity or latest_post_id):
+            return
+        if path is None:
+            path = self.filter(pk=forum_id).values_list('path', flat=True).first() or ''
+        ids = [int(i) for i in path.split('/') if i] or [forum_id]
+
+        def own(amount):
+            return Case(When(pk=forum_id, then=Value(amount)), default=Value(0))
+
+        values = {
+            'thread_count': F('thread_count') + own(threads),
+            'post_count': F('post_count') + own(posts),
+            'subtree_thread_count': F('subtree_thread_count') + threads,
+            'subtree_post_count': F('subtree_post_count') + posts,
+        }
+        if last_activity:
+            values['last_activity'] = Case(
+                When(Q(last_activity__isnull=True) | Q(last_activity__lt=last_activity),
+                     then=Value(last_activity)),
+                default=F('last_activity'))
+        if latest_post_id:
+            behind = Q(latest_post__isnull=True) | Q(latest_post__lt=latest_post_id)
+            values['latest_post'] = Case(When(behind, then=Value(latest_post_id)),
+                                         default=F('latest_post'), output_field=IntegerField())
+            values['latest_thread'] = Case(When(behind, then=Value(latest_thread_id)),
+                                           default=F('latest_thread'), output_field=IntegerField())
+        self.filter(pk__in=ids).update(**values)
+
+    def rebuild_counters(self, ids=None):
+        """
+        Recomputes the thread/post counters, subtree totals and latest
+        pointers of every forum (or of the forums in ids) from its threads.
+        """
+        Thread = self.model._meta.get_field('thread').related_model
+        threads = Thread.objects.filter(forum=OuterRef('pk')).order_by().values('forum')
+        subtree = Thread.objects.filter(forum__path__startswith=OuterRef('path')).order_by()
+
+        def over_subtree(function, field):
+            # A bare aggregate function, so the subquery is not grouped.
+            return Subquery(subtree.annotate(v=Func(field, function=function)).values('v'))
+
+        # Both pointers come from the thread with the newest latest post.
+        newest = subtree.filter(latest_post__isnull=False).order_by(
+            '-latest_post__submit_date', '-latest_post_id')
+
+        forums = self.all() if ids is None else self.filter(pk__in=ids)
+        return forums.update(
+            thread_count=Coalesce(Subquery(threads.annotate(c=Count('pk')).values('c')), 0),
+            post_count=Coalesce(Subquery(threads.annotate(s=Sum('posts')).values('s')), 0),
+            subtree_thread_count=Coalesce(over_subtree('COUNT', 'pk'), 0),
+            subtree_post_count=Coalesce(over_subtree('SUM', 'posts'), 0),
+            last_activity=over_subtree('MAX', 'latest_post__submit_date'),
+            latest_post=Subquery(newest.values('latest_post_id')[:1]),
+            latest_thread=Subquery(newest.values('pk')[:1]))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Forum = apps.get_model('forum', 'Forum')
+    forums = {f.pk: f for f in Forum.objects.all()}
+
+    def build(forum):
+        if forum.path:
+            return forum.path
+        if forum.parent_id and forum.parent_id in forums:
+            parent = forums[forum.parent_id]
+            forum.path = '%s%s/' % (build(parent), forum.pk)
+            forum.depth = parent.depth + 1
+        else:
+            forum.path = '%s/' % forum.pk
+            forum.depth = 0
+        return forum.path
+
+    for forum in forums.values():
+        build(forum)
+    Forum.objects.bulk_update(forums.values(), ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0005_thread_banned_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
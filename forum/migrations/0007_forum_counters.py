@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Forum = apps.get_model('forum', 'Forum')
+    Thread = apps.get_model('forum', 'Thread')
+    threads = Thread.objects.filter(forum=OuterRef('pk')).order_by().values('forum')
+    Forum.objects.update(
+        thread_count=Coalesce(Subquery(threads.annotate(c=Count('pk')).values('c')), 0),
+        post_count=Coalesce(Subquery(threads.annotate(s=Sum('posts')).values('s')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0006_forum_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='thread_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='post_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_slugs(apps, schema_editor):
+    Thread = apps.get_model('forum', 'Thread')
+    duplicated = (Thread.objects.values('slug').annotate(n=Count('pk'))
+                  .filter(n__gt=1).values_list('slug', flat=True))
+    for slug in list(duplicated):
+        # Keep the oldest thread on the original slug, number the rest.
+        for thread in Thread.objects.filter(slug=slug).order_by('pk')[1:]:
+            suffix = '-%s' % thread.pk
+            thread.slug = '%s%s' % (slug[:105 - len(suffix)], suffix)
+            thread.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_forum_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='thread',
+            name='slug',
+            field=models.SlugField(max_length=105, unique=True, verbose_name='Slug'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Posts of a thread: filtered on (content_type, object_pk), ordered by
+# submit_date. The comment model belongs to another app, so the index is
+# created directly rather than declared in its Meta.
+COMMENT_INDEX = models.Index(fields=['content_type', 'object_pk', 'submit_date'],
+                             name='forum_comment_thread_idx')
+
+
+def add_comment_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.COMMENTS_MODEL), COMMENT_INDEX)
+
+
+def remove_comment_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.COMMENTS_MODEL), COMMENT_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.COMMENTS_MODEL),
+        ('forum', '0008_thread_slug_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['forum', 'sticky', '-id'], name='forum_thread_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['title', 'comment'], name='forum_thread_title_idx'),
+        ),
+        migrations.RunPython(add_comment_index, remove_comment_index),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.COMMENTS_MODEL),
+        ('forum', '0009_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadPost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submit_date', models.DateTimeField()),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forum_thread_post', to=settings.COMMENTS_MODEL)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_posts', to='forum.thread')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['thread', 'submit_date', 'post'], name='forum_threadpost_thread_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_subtree_totals(apps, schema_editor):
+    Forum = apps.get_model('forum', 'Forum')
+    Thread = apps.get_model('forum', 'Thread')
+    subtree = Thread.objects.filter(forum__path__startswith=OuterRef('path')).order_by()
+
+    def over_subtree(function, field):
+        return Subquery(subtree.annotate(v=Func(field, function=function)).values('v'))
+
+    Forum.objects.update(
+        subtree_thread_count=Coalesce(over_subtree('COUNT', 'pk'), 0),
+        subtree_post_count=Coalesce(over_subtree('SUM', 'posts'), 0),
+        last_activity=over_subtree('MAX', 'latest_post__submit_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_threadpost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_thread_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_post_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_subtree_totals, migrations.RunPython.noop),
+    ]
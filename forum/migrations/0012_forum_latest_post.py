@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def populate_latest(apps, schema_editor):
+    Forum = apps.get_model('forum', 'Forum')
+    Thread = apps.get_model('forum', 'Thread')
+    newest = Thread.objects.filter(forum__path__startswith=OuterRef('path'),
+                                   latest_post__isnull=False).order_by(
+        '-latest_post__submit_date', '-latest_post_id')
+    Forum.objects.update(
+        latest_post=Subquery(newest.values('latest_post_id')[:1]),
+        latest_thread=Subquery(newest.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.COMMENTS_MODEL),
+        ('forum', '0011_forum_subtree_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='latest_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.COMMENTS_MODEL),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='latest_thread',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.thread'),
+        ),
+        migrations.RunPython(populate_latest, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_forum_latest_post'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecentActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('list', models.CharField(max_length=150)),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('object_id', models.IntegerField()),
+                ('stamp', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('list', 'slot')},
+                'indexes': [models.Index(fields=['list', '-stamp'], name='forum_activity_list_idx')],
+            },
+        ),
+    ]
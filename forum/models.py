@@ -5,19 +5,23 @@ Just about all logic required for smooth updates is in the save()
 methods. A little extra logic is in views.py.
 """
 
-import datetime
-import random
+import re
 
 from django.core import validators
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.functions import Cast, Concat, Length, Substr
 from django.template.defaultfilters import slugify
-from django.core.cache import caches
+from django.core.cache import InvalidCacheBackendError, caches
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sites.models import Site
-from django.contrib.contenttypes.models import ContentType
-from enuff.managers import EnuffManager
 from django.conf import settings
+try:
+    from enuff.managers import EnuffManager
+except ImportError:
+    EnuffManager = None
 try:
     from django.contrib import comments
     from django.contrib.comments.signals import comment_was_posted
@@ -25,88 +29,126 @@ except ImportError:
     import django_comments as comments
     from django_comments.signals import comment_was_posted
 
+from forum import activity
+from forum.counters import BufferedCounter
 from forum.managers import ForumManager
+from forum.registry import thread_content_type_id
 
 Comment = comments.get_model()
 
+# Inserts tried by Thread.save when another writer takes the same slug.
+FORUM_SLUG_SAVE_ATTEMPTS = getattr(settings, 'FORUM_SLUG_SAVE_ATTEMPTS', 5)
+FORUM_SITEMAP_LIMIT = getattr(settings, 'FORUM_SITEMAP_LIMIT', 50000)
+
 
 def SlugifyUniquely(value, model, slugfield="slug"):
-    MAX_SUFFIX_LENGTH = getattr(settings, 'MAX_SUFFIX_LENGTH', 3)
-    SUFFIX_CHARS = getattr(settings, 'SUFFIX_CHARS', 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
-    SLUGIFY_MAX_ATTEMPTS = getattr(settings, 'SLUGIFY_MAX_ATTEMPTS', 250)
+    """Returns a slug on a name which is unique within a model's table
 
-    def random_suffix_generator(size=MAX_SUFFIX_LENGTH, chars=SUFFIX_CHARS):
-        """
-        Generates a random string of length determined by size and using the
-        alphabet indicated by chars.
-        """
-        return ''.join(random.choice(chars) for i in range(size))
+    The free slug is found with a single query: of the existing "base"
+    and "base-N" slugs, found through an indexed prefix scan, the database
+    returns only the one with the highest N, and the next number is taken.
 
-    """Returns a slug on a name which is unique within a model's table
+    Two writers can still pick the same slug concurrently, so the slug
+    column should carry a unique index and the caller should retry on
+    IntegrityError (see Thread.save).
+    """
+    max_length = model._meta.get_field(slugfield).max_length
+    base = slugify(value)[:max_length] or model._meta.model_name
 
-    This code suffers a race condition between when a unique
-    slug is determined and when the object with that slug is saved.
-    It's also not exactly database friendly if there is a high
-    likelyhood of common slugs being attempted.
+    # A longer suffix is a larger number; among equal lengths, so is a later one.
+    top = model.objects.filter(**{
+        '%s__startswith' % slugfield: base,
+        '%s__regex' % slugfield: r'^%s(-[0-9]+)?$' % re.escape(base),
+    }).order_by(Length(slugfield).desc(), '-%s' % slugfield).values_list(slugfield, flat=True).first()
+    if top is None:
+        return base
 
-    A good usage pattern for this code would be to add a custom save()
-    method to a model with a slug field along the lines of:
+    suffix = '-%s' % ((0 if top == base else int(top[len(base) + 1:])) + 1)
+    return '%s%s' % (base[:max_length - len(suffix)], suffix)
 
-    from django.template.defaultfilters import slugify
 
-    def save(self):
-    if not self.id:
-    # replace self.name with your prepopulate_from field
-    self.slug = SlugifyUniquely(self.name, self.__class__)
-    super(self.__class__, self).save()
+def invalidate_pages(thread_slug=None, forums=()):
+    """
+    Bumps the generations cached pages of a thread, its forums and the
+    forum index are versioned by (see forum.pagecache).
 
-    Original pattern discussed at
-    http://www.b-list.org/weblog/2006/11/02/django-tips-auto-populated-fields
+    A forum's generation is bumped together with all of its ancestors,
+    whose pages show the subforum's counters and latest post.
     """
+    if thread_slug:
+        bump_generation('thread::%s' % thread_slug)
+    for forum in forums:
+        for f in forum.get_ancestors() + [forum]:
+            bump_generation('forum::%s' % f.slug)
+    bump_generation('index')
 
-    max_length = model._meta.get_field(slugfield).max_length
-    potential = base = slugify(value)
-    date = datetime.date.today().strftime("%d-%m-%y")
 
-    for attempt in range(SLUGIFY_MAX_ATTEMPTS):
-        old_potential = potential
-        random_suffix = random_suffix_generator()
-        try:
-            # For the first try (0) just use the base
-            # For the next 5 tries, just add a number
-            if 5 > attempt > 0:
-                potential = '%s-%s' % (base[:max_length - 2], attempt)
-            # One try with just the date
-            if attempt == 5:
-                potential = '%s-%s' % (date, base)
-            # Everything else failed,
-            # use the date plus a random suffix for the rest
-            elif attempt > 5:
-                potential = '%s-%s-%s' % (date, random_suffix, base)
-
-            # Cut it to the max length of the model slug field.
-            potential = potential[:max_length]
-            model.objects.get(**{slugfield: potential})
-
-            if attempt > 0 and potential == old_potential:
-                # Then, the next iteration will be the same, just stop.
-                raise Exception("SlugifyUnique: not able to generate an unique slug. (%s)" % potential)
-        except model.DoesNotExist:
-            # Good, we found one.
-            return potential
-
-    # Oh noo! Max attempts reached.
-    raise Exception("SlugifyUnique: Max attempts reached. (%s) last value: %s" % (SLUGIFY_MAX_ATTEMPTS, potential))
+def invalidate_tags(user_id=None):
+    """
+    Bumps the generations the forum template tags cache their results
+    under: the site-wide latest posts/threads, and the latest posts of
+    user_id.
+    """
+    bump_generation('tags')
+    if user_id:
+        bump_generation('tags::user::%s' % user_id)
+
+
+def sitemap_section(pk):
+    """ The sitemap page listing the thread or post with primary key pk. """
+    return (pk - 1) // FORUM_SITEMAP_LIMIT + 1
+
+
+def invalidate_sitemaps(thread_id=None, post_id=None):
+    """
+    Bumps the generations of the cached sitemap sections (see
+    forum.sitemap) listing a thread and a post.
+    """
+    if thread_id:
+        bump_generation('sitemap::threads::%s' % sitemap_section(thread_id))
+    if post_id:
+        bump_generation('sitemap::posts::%s' % sitemap_section(post_id))
 
 
 def update_thread(sender, request, **kwargs):
+    """
+    Counts a reply against its thread and forum.
+
+    The thread row is changed with a single conditional UPDATE, so that
+    concurrent replies cannot lose increments and latest_post only ever
+    moves forward. With FORUM_BUFFERED_REPLY_COUNTS the increments are
+    buffered in process and flushed in batches instead, and the cached
+    pages showing them are invalidated again by the flush.
+    """
     instance = kwargs.get('comment')
-    if instance.content_object.__class__ == Thread:
-        x = instance.content_object
-        x.latest_post = instance
-        x.posts += 1
-        x.save()
-        Thread.nonrel_objects.push_to_list("%s-latest-threads" % x.forum.slug, x, trim=25)
+    if instance.content_type_id != thread_content_type_id():
+        return
+    x = Thread.objects.select_related('forum').get(pk=instance.object_pk)
+    if getattr(settings, 'FORUM_BUFFERED_REPLY_COUNTS', False):
+        thread_reply_counter.incr(x.pk, latest=instance.pk)
+        forum_post_counter.incr(x.forum_id)
+        for forum_id in x.forum.path.split('/')[:-1]:
+            forum_subtree_post_counter.incr(int(forum_id), latest=instance.pk)
+    else:
+        with transaction.atomic():
+            Thread.objects.filter(pk=x.pk).update(
+                posts=models.F('posts') + 1,
+                latest_post=models.Case(
+                    models.When(models.Q(latest_post__isnull=True) | models.Q(latest_post__lt=instance.pk),
+                                then=models.Value(instance.pk)),
+                    default=models.F('latest_post'), output_field=models.IntegerField()))
+            Forum.objects.adjust_counters(x.forum_id, posts=1, last_activity=instance.submit_date,
+                                          path=x.forum.path, latest_post_id=instance.pk,
+                                          latest_thread_id=x.pk)
+    activity.push("%s-latest-threads" % x.forum.slug, x.pk, trim=25)
+    activity.push("latest-threads", x.pk, trim=50)
+    activity.push("latest-posts", instance.pk, trim=50)
+    if instance.user_id:
+        activity.push("user-%s-latest-posts" % instance.user_id, instance.pk, trim=20)
+    if get_forum_cache():
+        invalidate_pages(x.slug, [x.forum])
+        invalidate_sitemaps(x.pk, instance.pk)
+        invalidate_tags(instance.user_id)
 
 comment_was_posted.connect(update_thread, sender=Comment)
 
@@ -114,11 +156,30 @@ comment_was_posted.connect(update_thread, sender=Comment)
 def get_forum_cache():
     try:
         cache = caches['forum']
-    except KeyError:
+    except InvalidCacheBackendError:
         cache = None
     return cache
 
 
+def get_generation(name):
+    """
+    Current generation number of name. Cache keys that embed it are
+    invalidated all at once by bump_generation(name).
+    """
+    cache = get_forum_cache()
+    return cache.get('forum::generation::%s' % name, 0) if cache else 0
+
+
+def bump_generation(name):
+    cache = get_forum_cache()
+    if cache:
+        key = 'forum::generation::%s' % name
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, None)
+
+
 class Category(models.Model):
     only_upgraders = models.BooleanField(default=False)
     title = models.CharField(max_length=250)
@@ -130,8 +191,8 @@ class Forum(models.Model):
     """
     Very basic outline for a Forum, or group of threads.
 
-    All of the parent/child recursion code here is borrowed directly from
-    the Satchmo project: http://www.satchmoproject.com/
+    The tree is stored as a materialized path so that ancestors and
+    descendants can each be fetched with a single query.
     """
     restricted = models.BooleanField(default=False)  # used in conjunction with below
     allowed_users = models.ManyToManyField(
@@ -146,118 +207,85 @@ class Forum(models.Model):
     only_staff_reads = models.BooleanField(default=False)
     only_upgraders = models.BooleanField(default=False)
     category = models.ForeignKey(Category, on_delete=models.PROTECT, blank=True, null=True)
+    # Materialized path of primary keys ("1/5/9/"), maintained in save().
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Denormalized counters, kept current by Thread.save() and update_thread.
+    # Run the forum_rebuild_counters command to recompute them.
+    thread_count = models.IntegerField(default=0, editable=False)
+    post_count = models.IntegerField(default=0, editable=False)
+    # The same totals over this forum and all its descendants.
+    subtree_thread_count = models.IntegerField(default=0, editable=False)
+    subtree_post_count = models.IntegerField(default=0, editable=False)
+    last_activity = models.DateTimeField(null=True, blank=True, editable=False)
+    # Newest post in the subtree and its thread, moved forward on every post.
+    latest_post = models.ForeignKey(
+        Comment, editable=False, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    latest_thread = models.ForeignKey(
+        'Thread', editable=False, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
 
     objects = ForumManager()
 
     @property
     def posts(self):
-        """
-        Get posts count for this forum (the sum of thread posts).
-        Cached for an hour.
-        """
-        key = "forum::{}::posts".format(self.pk)
-        cache = get_forum_cache()
-        value = cache.get(key) if cache else None
-        if value:
-            return value
-
-        value = self.thread_set.aggregate(models.Sum('posts'))['posts__sum']
-
-        if cache:
-            cache.set(key, value, 60*60)
-
-        return value
+        """ Get posts count for this forum (the sum of thread posts). """
+        return self.post_count
 
     @property
     def threads(self):
-        """ Get threads count for this forum. Cached for an hour. """
-        key = "forum::{}::threads".format(self.pk)
-        cache = get_forum_cache()
-        value = cache.get(key) if cache else None
-        if value:
-            return value
-
-        value = self.thread_set.count()
-
-        if cache:
-            cache.set(key, value, 60*60)
-
-        return value
+        """ Get threads count for this forum. """
+        return self.thread_count
 
     def latest_threads(self, limit=10):
-        return Thread.nonrel_objects.get_list('%s-latest-threads' % self.slug, limit=limit)
+        return activity.get_objects('%s-latest-threads' % self.slug,
+                                    Thread.objects.select_related('forum', 'latest_post'), limit)
 
     def _get_forum_latest_post(self):
-        """This gets the latest post for the forum"""
-        if not hasattr(self, '__forum_latest_post'):
-            Post = comments.get_model()
-        ct = ContentType.objects.get_for_model(Forum)
-        try:
-            self.__forum_latest_post = Post.objects.filter(
-                content_type=ct, object_pk=self.id).latest("submit_date")
-        except Post.DoesNotExist:
-            self.__forum_latest_post = None
-        return self.__forum_latest_post
+        """This gets the latest post in the forum or any of its subforums"""
+        return self.latest_post
     forum_latest_post = property(_get_forum_latest_post)
 
-    def _recurse_for_parents_slug(self, forum_obj):
-        # This is used for the urls
-        p_list = []
-        if forum_obj.parent_id:
-            p = forum_obj.parent
-            p_list.append(p.slug)
-            more = self._recurse_for_parents_slug(p)
-            p_list.extend(more)
-        if forum_obj == self and p_list:
-            p_list.reverse()
-        return p_list
+    def get_ancestors(self):
+        """
+        Returns the parent forums, root first, resolved from the stored
+        path in a single query. The result is memoized on the instance.
+        """
+        if not hasattr(self, '_ancestors_cache'):
+            ids = [int(i) for i in self.path.split('/') if i][:-1]
+            if ids:
+                ancestors = Forum.objects.filter(pk__in=ids).order_by('depth')
+                self._ancestors_cache = list(ancestors)
+            else:
+                self._ancestors_cache = []
+        return self._ancestors_cache
+
+    def get_descendants(self):
+        """ All forums below this one, in tree order, as one indexed query. """
+        if not self.path:
+            return Forum.objects.none()
+        return Forum.objects.filter(path__startswith=self.path).exclude(pk=self.pk).order_by('path')
 
     def get_absolute_url(self):
-        p_list = self._recurse_for_parents_slug(self)
+        p_list = [p.slug for p in self.get_ancestors()]
         p_list.append(self.slug)
         return '%s%s/' % (reverse('forum_list'), '/'.join(p_list))
 
-    def _recurse_for_parents_name(self, forum_obj):
-        # This is used for the visual display & save validation
-        p_list = []
-        if forum_obj.parent_id:
-            p = forum_obj.parent
-            p_list.append(p.title)
-            more = self._recurse_for_parents_name(p)
-            p_list.extend(more)
-        if forum_obj == self and p_list:
-            p_list.reverse()
-        return p_list
-
     def get_separator(self):
         return ' &raquo; '
 
     def _parents_repr(self):
-        p_list = self._recurse_for_parents_name(self)
+        p_list = [p.title for p in self.get_ancestors()]
         return self.get_separator().join(p_list)
     _parents_repr.short_description = _("Forum parents")
 
-    def _recurse_for_parents_name_url(self, forum__obj):
-        # Get all the absolute urls and names (for use in site navigation)
-        p_list = []
-        url_list = []
-        if forum__obj.parent_id:
-            p = forum__obj.parent
-            p_list.append(p.title)
-            url_list.append(p.get_absolute_url())
-            more, url = self._recurse_for_parents_name_url(p)
-            p_list.extend(more)
-            url_list.extend(url)
-        if forum__obj == self and p_list:
-            p_list.reverse()
-            url_list.reverse()
-        return p_list, url_list
-
     def get_url_name(self):
         # :Get a list of the url to display and the actual urls
-        p_list, url_list = self._recurse_for_parents_name_url(self)
-        p_list.append(self.title)
-        url_list.append(self.get_absolute_url())
+        base = reverse('forum_list')
+        slugs, p_list, url_list = [], [], []
+        for forum in self.get_ancestors() + [self]:
+            slugs.append(forum.slug)
+            p_list.append(forum.title)
+            url_list.append('%s%s/' % (base, '/'.join(slugs)))
         return zip(p_list, url_list)
 
     def __unicode__(self):
@@ -271,38 +299,45 @@ class Forum(models.Model):
         verbose_name = _('Forum')
         verbose_name_plural = _('Forums')
 
+    def _build_path(self):
+        if self.parent_id:
+            # Read the parent's path from the database, the related instance may be stale.
+            parent_path, parent_depth = Forum.objects.filter(
+                pk=self.parent_id).values_list('path', 'depth').get()
+            return '%s%s/' % (parent_path, self.pk), parent_depth + 1
+        return '%s/' % self.pk, 0
+
     def save(self, force_insert=False, force_update=False):
         self.site = self.site or Site.objects.get_current()
-        p_list = self._recurse_for_parents_name(self)
-        if (self.title) in p_list:
-            raise validators.ValidationError(_("You must not save a forum in itself!"))
+        old_path, old_depth = self.path, self.depth
+        if self.pk:
+            self.path, self.depth = self._build_path()
+            if str(self.pk) in self.path.split('/')[:-2]:
+                raise validators.ValidationError(_("You must not save a forum in itself!"))
         super(Forum, self).save(force_insert, force_update)
-
-    def _flatten(self, L):
-        """
-        Taken from a python newsgroup post
-        """
-        if not isinstance(L, list):
-            return [L]
-        if L == []:
-            return L
-        return self._flatten(L[0]) + self._flatten(L[1:])
-
-    def _recurse_for_children(self, node):
-        children = []
-        children.append(node)
-        for child in node.child.all():
-            children_list = self._recurse_for_children(child)
-            children.append(children_list)
-        return children
+        if not self.path:
+            # Freshly inserted, the primary key is only known now.
+            self.path, self.depth = self._build_path()
+            Forum.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        elif old_path and old_path != self.path:
+            # Moved: rewrite the prefix of every descendant in one UPDATE.
+            Forum.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(models.Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=models.F('depth') + (self.depth - old_depth))
+            # Both ancestor chains lose or gain the subtree's totals and
+            # possibly their latest pointers, so they are recomputed.
+            ancestors = set(int(i) for path in (old_path, self.path) for i in path.split('/')[:-2])
+            Forum.objects.rebuild_counters(ids=ancestors)
+        self.__dict__.pop('_ancestors_cache', None)
+        # Titles, tree and access rules show up on every cached page.
+        bump_generation('forums')
+        invalidate_tags()
 
     def get_all_children(self):
         """
         Gets a list of all of the children forums.
         """
-        children_list = self._recurse_for_children(self)
-        flat_list = self._flatten(children_list[1:])
-        return flat_list
+        return list(self.get_descendants())
 
 
 class Thread(models.Model):
@@ -316,7 +351,7 @@ class Thread(models.Model):
     featured = models.BooleanField(default=False, blank=True)
     forum = models.ForeignKey(Forum, on_delete=models.CASCADE)
     title = models.CharField(_("Title"), max_length=100)
-    slug = models.SlugField(_("Slug"), max_length=105)
+    slug = models.SlugField(_("Slug"), max_length=105, unique=True)
     sticky = models.BooleanField(_("Sticky?"), blank=True, default=False)
     closed = models.BooleanField(_("Closed?"), blank=True, default=False)
     posts = models.IntegerField(_("Posts"), default=0)
@@ -330,19 +365,68 @@ class Thread(models.Model):
         'auth.User', blank=True, related_name="banned_forums")
 
     objects = models.Manager()
-    nonrel_objects = EnuffManager()
+    if EnuffManager is not None:
+        nonrel_objects = EnuffManager()
 
     class Meta:
         ordering = ('-id',)
         verbose_name = _('Thread')
         verbose_name_plural = _('Threads')
+        indexes = [
+            # ThreadList: forum.thread_set.filter(sticky=...) ordered by -id.
+            models.Index(fields=['forum', 'sticky', '-id'], name='forum_thread_listing_idx'),
+            # ThreadForm.clean_title: duplicate titles by the same author.
+            models.Index(fields=['title', 'comment'], name='forum_thread_title_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Thread, cls).from_db(db, field_names, values)
+        instance._loaded_forum_id = instance.__dict__.get('forum_id')
+        return instance
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = SlugifyUniquely(self.title, Thread)
         if not self.sticky:
             self.sticky = False
-        super(Thread, self).save(*args, **kwargs)
+        adding = self._state.adding
+        old_forum_id = getattr(self, '_loaded_forum_id', None)
+        auto_slug = not self.slug
+        if auto_slug:
+            self.slug = SlugifyUniquely(self.title, Thread)
+        for attempt in range(FORUM_SLUG_SAVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    super(Thread, self).save(*args, **kwargs)
+                    if adding:
+                        Forum.objects.adjust_counters(self.forum_id, threads=1, posts=self.posts,
+                                                      last_activity=timezone.now(),
+                                                      latest_post_id=self.latest_post_id,
+                                                      latest_thread_id=self.pk)
+                    elif old_forum_id and old_forum_id != self.forum_id:
+                        # Recount both chains from the moved row; ancestors they
+                        # share must not see the thread leave and arrive twice.
+                        paths = Forum.objects.filter(pk__in=[old_forum_id, self.forum_id]).values_list(
+                            'path', flat=True)
+                        Forum.objects.rebuild_counters(
+                            ids=set(int(i) for path in paths for i in path.split('/') if i))
+                    elif self.latest_post_id:
+                        # ThreadForm attaches the opening post on a second save.
+                        Forum.objects.adjust_counters(self.forum_id, latest_post_id=self.latest_post_id,
+                                                      latest_thread_id=self.pk)
+                break
+            except IntegrityError:
+                # Somebody else took the slug between allocation and insert.
+                if not auto_slug or attempt == FORUM_SLUG_SAVE_ATTEMPTS - 1:
+                    raise
+                self.slug = SlugifyUniquely(self.title, Thread)
+        if get_forum_cache():
+            forums = [self.forum]
+            if old_forum_id and old_forum_id != self.forum_id:
+                forums.extend(Forum.objects.filter(pk=old_forum_id))
+            invalidate_pages(self.slug, forums)
+            invalidate_sitemaps(self.pk, self.comment_id)
+            invalidate_tags(self.comment.user_id if self.comment_id else None)
+        self._loaded_forum_id = self.forum_id
 
     def get_absolute_url(self):
         return reverse('forum_view_thread', args=[self.forum.slug, self.slug])
@@ -352,3 +436,146 @@ class Thread(models.Model):
 
     def __str__(self):
         return u'%s' % self.title.replace('[[', '').replace(']]', '')
+
+
+class ThreadPost(models.Model):
+    """
+    Integer keyed link from a thread to each of its posts.
+
+    Comments point at their thread through the generic, text typed
+    object_pk, which indexes and compares poorly. This side table is
+    filled whenever a post is saved on a thread (and by the
+    forum_backfill_thread_posts command), so posts can be found with an
+    integer range scan on (thread, submit_date). Set
+    FORUM_THREAD_POST_INDEX = True once it has been backfilled.
+    """
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='thread_posts')
+    post = models.OneToOneField(Comment, on_delete=models.CASCADE, related_name='forum_thread_post')
+    submit_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'submit_date', 'post'], name='forum_threadpost_thread_idx'),
+        ]
+
+
+class RecentActivity(models.Model):
+    """
+    One slot of a recent activity list kept by
+    forum.activity.DatabaseActivityList.
+    """
+    list = models.CharField(max_length=150)
+    slot = models.PositiveSmallIntegerField()
+    object_id = models.IntegerField()
+    stamp = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('list', 'slot'),)
+        indexes = [
+            models.Index(fields=['list', '-stamp'], name='forum_activity_list_idx'),
+        ]
+
+
+def index_thread_post(sender, instance, created, **kwargs):
+    if created and instance.content_type_id == thread_content_type_id():
+        ThreadPost.objects.create(thread_id=int(instance.object_pk), post=instance,
+                                  submit_date=instance.submit_date)
+
+post_save.connect(index_thread_post, sender=Comment)
+
+
+def post_changed(sender, instance, created=False, **kwargs):
+    """
+    Edits, moderation and deletion of a post invalidate the cached pages,
+    feeds and tags that may show it.
+    """
+    if not created and instance.content_type_id == thread_content_type_id() and get_forum_cache():
+        thread = Thread.objects.select_related('forum').filter(pk=instance.object_pk).first()
+        if thread:
+            invalidate_pages(thread.slug, [thread.forum])
+        invalidate_tags(instance.user_id)
+
+post_save.connect(post_changed, sender=Comment)
+post_delete.connect(post_changed, sender=Comment)
+
+
+def thread_posts(thread):
+    """
+    The posts of thread, oldest first, through ThreadPost when enabled.
+    """
+    if getattr(settings, 'FORUM_THREAD_POST_INDEX', False):
+        return Comment.objects.filter(forum_thread_post__thread=thread).order_by('submit_date', 'id')
+    return Comment.objects.filter(
+        content_type_id=thread_content_type_id(), object_pk=thread.pk).order_by('submit_date', 'id')
+
+
+def forum_posts(forums):
+    """
+    The posts of every thread in forums, through ThreadPost when enabled.
+    """
+    if getattr(settings, 'FORUM_THREAD_POST_INDEX', False):
+        return Comment.objects.filter(forum_thread_post__thread__forum__in=forums)
+    threads = Thread.objects.filter(forum__in=forums).annotate(
+        key=Cast('pk', models.CharField())).values('key')
+    return Comment.objects.filter(content_type_id=thread_content_type_id(), object_pk__in=threads)
+
+
+def thread_deleted(sender, instance, **kwargs):
+    # The thread's posts outlive it, so the latest pointers of its forums
+    # are recomputed along with the counters rather than shifted.
+    path = Forum.objects.filter(pk=instance.forum_id).values_list('path', flat=True).first()
+    Forum.objects.rebuild_counters(ids=[int(i) for i in (path or '').split('/') if i])
+    if get_forum_cache():
+        invalidate_pages(instance.slug, Forum.objects.filter(pk=instance.forum_id))
+        invalidate_sitemaps(instance.pk, instance.comment_id)
+        invalidate_tags()
+
+post_delete.connect(thread_deleted, sender=Thread)
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached allowed/banned id sets of forum.permissions,
+    for the users whose membership changed only.
+    """
+    kind = 'allowed' if sender is Forum.allowed_users.through else 'banned'
+    if action == 'pre_clear':
+        # The rows are gone by post_clear, so note whose they were.
+        field = 'user' if reverse else ('forum' if kind == 'allowed' else 'thread')
+        instance._forum_cleared_users = set(
+            sender.objects.filter(**{field: instance}).values_list('user_id', flat=True))
+        return
+    if action == 'post_clear':
+        user_ids = instance.__dict__.pop('_forum_cleared_users', ())
+    elif action in ('post_add', 'post_remove'):
+        user_ids = ([instance.pk] if pk_set else []) if reverse else pk_set
+    else:
+        return
+    for user_id in user_ids:
+        bump_generation('%s::user::%s' % (kind, user_id))
+
+m2m_changed.connect(membership_changed, sender=Forum.allowed_users.through)
+m2m_changed.connect(membership_changed, sender=Thread.banned_users.through)
+
+
+def threads_flushed(pks):
+    """ Buffered reply counts reached the database: drop the pages showing them. """
+    if get_forum_cache():
+        for thread in Thread.objects.filter(pk__in=pks).select_related('forum'):
+            invalidate_pages(thread.slug, [thread.forum])
+        invalidate_tags()
+
+
+def forums_flushed(pks):
+    if get_forum_cache():
+        invalidate_pages(forums=Forum.objects.prefetch_ancestors(Forum.objects.filter(pk__in=pks)))
+
+thread_reply_counter = BufferedCounter(Thread, 'posts', latest_field='latest_post', on_flush=threads_flushed)
+forum_post_counter = BufferedCounter(Forum, 'post_count', on_flush=forums_flushed)
+# latest_thread is not kept current in buffered mode, only latest_post.
+forum_subtree_post_counter = BufferedCounter(Forum, 'subtree_post_count', latest_field='latest_post',
+                                             on_flush=forums_flushed)
+thread_view_counter = BufferedCounter(
+    Thread, 'views',
+    flush_interval=getattr(settings, 'FORUM_VIEW_FLUSH_INTERVAL', None),
+    max_pending=getattr(settings, 'FORUM_VIEW_MAX_PENDING', None))
@@ -0,0 +1,68 @@
+"""
+Whole-page cache for anonymous readers.
+
+Rendered pages are stored in the forum cache under keys that embed the
+generation numbers of what they display (a thread, a forum, the index).
+Writes bump those generations (see invalidate_pages in forum.models),
+and buffered reply counts bump them again when they are flushed, so a
+page is never served stale and no TTL has to be guessed; the timeout
+only bounds how long unused entries linger.
+
+Enable with FORUM_PAGE_CACHE = True and a "forum" cache alias.
+"""
+
+import hashlib
+
+from django.conf import settings
+
+from forum.models import get_forum_cache, get_generation
+
+
+FORUM_PAGE_CACHE = getattr(settings, 'FORUM_PAGE_CACHE', False)
+FORUM_PAGE_CACHE_TIMEOUT = getattr(settings, 'FORUM_PAGE_CACHE_TIMEOUT', 60*60*24)
+
+
+class AnonymousPageCacheMixin(object):
+    """
+    Caches the GET responses a view renders for anonymous users.
+
+    Views name the generations their page depends on in
+    get_page_generations(). Anything returned by get_page_cache_extra()
+    is stored alongside the page and handed to page_cache_hit() when the
+    page is served from the cache.
+    """
+
+    def get_page_generations(self):
+        raise NotImplementedError
+
+    def get_page_cache_extra(self):
+        return None
+
+    def page_cache_hit(self, extra):
+        pass
+
+    def get_page_cache_key(self):
+        versions = ':'.join('%s=%s' % (name, get_generation(name))
+                            for name in self.get_page_generations() + ['forums'])
+        key = '%s|%s' % (versions, self.request.get_full_path())
+        return 'forum::page::%s' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        cache = get_forum_cache()
+        if (not FORUM_PAGE_CACHE or not cache or request.method != 'GET' or
+                request.user.is_authenticated):
+            return super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            extra, response = cached
+            self.page_cache_hit(extra)
+            return response
+
+        response = super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            extra = self.get_page_cache_extra()
+            response.add_post_render_callback(
+                lambda r: cache.set(key, (extra, r), FORUM_PAGE_CACHE_TIMEOUT))
+        return response
@@ -0,0 +1,92 @@
+"""
+Cursor based ("keyset" or "seek") pagination for the forum list views.
+
+Instead of OFFSET, each page is fetched with a WHERE clause on the sort
+key of the last row shown, so page N costs the same as page 1 and no
+COUNT(*) is needed. Enable it with FORUM_KEYSET_PAGINATION = True.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+FORUM_KEYSET_PAGINATION = getattr(settings, 'FORUM_KEYSET_PAGINATION', False)
+
+
+class KeysetPaginationMixin(object):
+    """
+    ListView mixin paginating on keyset_fields, which must be unique
+    together (end with the primary key). A leading "-" sorts descending.
+
+    The context gets next_cursor/prev_cursor for ?after= and ?before=
+    links, and estimated_count from get_estimated_count().
+    """
+    keyset_fields = ('-id',)
+    next_cursor = prev_cursor = None
+
+    def get_estimated_count(self):
+        return None
+
+    def _seek(self, model, cursor, forward):
+        try:
+            values = force_str(urlsafe_base64_decode(cursor)).split('|')
+            if len(values) != len(self.keyset_fields):
+                raise ValueError
+            values = [model._meta.get_field(f.lstrip('-')).to_python(v)
+                      for f, v in zip(self.keyset_fields, values)]
+        except (ValueError, ValidationError):
+            raise Http404("Invalid cursor")
+
+        # (a, b) > (x, y) spelled out as a > x OR (a = x AND b > y).
+        condition, equal = Q(), {}
+        for field, value in zip(self.keyset_fields, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') == forward else 'gt'
+            condition |= Q(**dict(equal, **{'%s__%s' % (name, lookup): value}))
+            equal[name] = value
+        return condition
+
+    def _cursor(self, obj):
+        values = [str(getattr(obj, f.lstrip('-'))) for f in self.keyset_fields]
+        return urlsafe_base64_encode('|'.join(values).encode('utf-8'))
+
+    def paginate_queryset(self, queryset, page_size):
+        if not FORUM_KEYSET_PAGINATION:
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        if before:
+            reverse = [f[1:] if f.startswith('-') else '-' + f for f in self.keyset_fields]
+            queryset = queryset.filter(self._seek(queryset.model, before, False)).order_by(*reverse)
+        else:
+            if after:
+                queryset = queryset.filter(self._seek(queryset.model, after, True))
+            queryset = queryset.order_by(*self.keyset_fields)
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if before:
+            rows.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = bool(after), has_more
+
+        self.next_cursor = self._cursor(rows[-1]) if rows and has_next else None
+        self.prev_cursor = self._cursor(rows[0]) if rows and has_prev else None
+        return None, None, rows, bool(self.next_cursor or self.prev_cursor)
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        if FORUM_KEYSET_PAGINATION:
+            context.update({
+                'next_cursor': self.next_cursor,
+                'prev_cursor': self.prev_cursor,
+                'estimated_count': self.get_estimated_count(),
+            })
+        return context
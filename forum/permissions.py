@@ -0,0 +1,103 @@
+"""
+Forum access rules, evaluated once per user object.
+
+request.user lives for exactly one request, so memoizing the rights on it
+gives views and template filters a per-request permission context: the
+restricted forums a user is allowed into and the threads they are banned
+from are each loaded with a single query, and every further check is
+answered from memory.
+
+With a forum cache configured those id sets are cached per user, and
+invalidated whenever that user's allowed_users or banned_users rows change.
+"""
+
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from forum.models import Forum, Thread, get_forum_cache, get_generation
+
+
+FORUM_PERMISSION_CACHE_TIMEOUT = getattr(settings, 'FORUM_PERMISSION_CACHE_TIMEOUT', 60*60)
+
+
+def _member_ids(kind, user, queryset):
+    """
+    The ids in queryset, read through the forum cache under a key that
+    carries the generation of kind for user.
+    """
+    cache = get_forum_cache()
+    if not cache:
+        return frozenset(queryset)
+    key = 'forum::%s::%s::%s' % (kind, get_generation('%s::user::%s' % (kind, user.pk)), user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(queryset)
+        cache.set(key, ids, FORUM_PERMISSION_CACHE_TIMEOUT)
+    return ids
+
+
+def is_upgraded(user):
+    return (user.is_authenticated and
+            getattr(getattr(user, 'userprofile', None), 'is_upgraded', False))
+
+
+class ForumPermissions(object):
+    def __init__(self, user):
+        self.user = user
+        self.is_authenticated = user.is_authenticated
+        self.is_staff = self.is_authenticated and (user.is_staff or user.is_superuser)
+        self.is_upgraded = is_upgraded(user)
+
+    @cached_property
+    def allowed_forum_ids(self):
+        """ Restricted forums this user has been let into. """
+        if not self.is_authenticated:
+            return frozenset()
+        return _member_ids('allowed', self.user, Forum.allowed_users.through.objects.filter(
+            user=self.user).values_list('forum_id', flat=True))
+
+    @cached_property
+    def banned_thread_ids(self):
+        """ Threads this user may not reply to. """
+        if not self.is_authenticated:
+            return frozenset()
+        return _member_ids('banned', self.user, Thread.banned_users.through.objects.filter(
+            user=self.user).values_list('thread_id', flat=True))
+
+    def can_read(self, forum):
+        if forum.only_staff_reads and not self.is_staff:
+            return False
+        if forum.only_upgraders and not (self.is_staff or self.is_upgraded):
+            return False
+        if forum.restricted and forum.pk not in self.allowed_forum_ids:
+            return False
+        return True
+
+    def can_post(self, forum):
+        if not self.is_authenticated or not self.can_read(forum):
+            return False
+        if forum.only_staff_posts:
+            return self.is_staff
+        if forum.only_upgraders:
+            return self.is_staff or self.is_upgraded
+        return True
+
+    def can_moderate(self, forum):
+        return self.is_staff
+
+    def can_reply(self, thread):
+        return self.is_authenticated and thread.pk not in self.banned_thread_ids
+
+    def readable(self, forums):
+        return [forum for forum in forums if self.can_read(forum)]
+
+
+def get_permissions(user):
+    """
+    Returns the ForumPermissions of user, building them on first use.
+    """
+    permissions = getattr(user, '_forum_permissions', None)
+    if permissions is None:
+        permissions = ForumPermissions(user)
+        user._forum_permissions = permissions
+    return permissions
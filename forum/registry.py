@@ -0,0 +1,44 @@
+"""
+Lookups the forum needs on nearly every request, resolved once per
+process: the comment model and the content type ids of Thread and Forum.
+
+Posts can then be filtered on a plain integer content_type_id. The
+values are warmed by the first request (see ForumConfig.ready).
+"""
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+
+try:
+    from django.contrib import comments
+except ImportError:
+    import django_comments as comments
+
+_registry = {}
+
+
+def get_comment_model():
+    if 'comment_model' not in _registry:
+        _registry['comment_model'] = comments.get_model()
+    return _registry['comment_model']
+
+
+def _content_type_id(model_name):
+    if model_name not in _registry:
+        model = apps.get_model('forum', model_name)
+        _registry[model_name] = ContentType.objects.get_for_model(model).pk
+    return _registry[model_name]
+
+
+def thread_content_type_id():
+    return _content_type_id('Thread')
+
+
+def forum_content_type_id():
+    return _content_type_id('Forum')
+
+
+def warm(sender=None, **kwargs):
+    get_comment_model()
+    thread_content_type_id()
+    forum_content_type_id()
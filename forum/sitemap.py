@@ -1,7 +1,83 @@
-from django.contrib.sitemaps import Sitemap
+"""
+Sitemaps for forums, threads and posts.
+
+Threads and posts are streamed as value tuples, lastmod included, and
+split into sections of FORUM_SITEMAP_LIMIT primary keys each: section N
+is a range scan over pk, so no OFFSET or COUNT(*) is needed and a new
+post only changes the section it falls into. Serve them with the
+sitemap view below and django.contrib.sitemaps.views.index:
+
+    path('sitemap.xml', sitemaps_views.index, {'sitemaps': sitemap_dict}),
+    path('sitemap-<section>.xml', forum.sitemap.sitemap, {'sitemaps': sitemap_dict},
+         name='django.contrib.sitemaps.views.sitemap'),
+
+With a forum cache, rendered sections are kept until a write to one of
+their threads or posts bumps their generation (see invalidate_sitemaps).
+"""
+
+from django.conf import settings
+from django.contrib.sitemaps import Sitemap, views
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger
+from django.db.models import Max
 from django.urls import reverse
+from django.utils.functional import cached_property
+
+from forum.models import FORUM_SITEMAP_LIMIT, Forum, Thread, get_forum_cache, get_generation
+from forum.registry import get_comment_model, thread_content_type_id
+
+
+FORUM_SITEMAP_CHUNK_SIZE = getattr(settings, 'FORUM_SITEMAP_CHUNK_SIZE', 2000)
+FORUM_SITEMAP_CACHE_TIMEOUT = getattr(settings, 'FORUM_SITEMAP_CACHE_TIMEOUT', 60*60*24)
+
+
+class KeyRangePaginator(object):
+    """
+    Pages a values_list queryset, whose first value is the primary key,
+    by ranges of per_page primary keys. Pages hold at most per_page rows
+    and are read with iterator(), so they are never held in memory.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @cached_property
+    def num_pages(self):
+        top = self.queryset.aggregate(top=Max('pk'))['top'] or 0
+        return max(1, (top - 1) // self.per_page + 1)
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1 or number > self.num_pages:
+            raise EmptyPage("That page contains no results")
+        bottom = (number - 1) * self.per_page
+        rows = self.queryset.filter(pk__gt=bottom, pk__lte=bottom + self.per_page).order_by('pk')
+        return Page(rows.iterator(chunk_size=FORUM_SITEMAP_CHUNK_SIZE), number, self)
+
+
+class StreamingSitemap(Sitemap):
+    """
+    Sitemap over values_list rows: the primary key first, lastmod last.
+    Its pages are versioned by the "sitemap::<generation>::<page>"
+    generations.
+    """
+    limit = FORUM_SITEMAP_LIMIT
+    generation = None
+
+    @property
+    def paginator(self):
+        return KeyRangePaginator(self.items(), self.limit)
+
+    def lastmod(self, item):
+        return item[-1]
+
+    def get_latest_lastmod(self):
+        # Forum.last_activity already holds the newest post of each forum.
+        return Forum.objects.aggregate(latest=Max('last_activity'))['latest']
 
-from forum.models import Forum, Thread
 
 class ForumSitemap(Sitemap):
     changefreq = 'weekly'
@@ -9,25 +85,51 @@ class ForumSitemap(Sitemap):
     def items(self):
         return Forum.objects.all()
 
-    def last_mod(self, obj):
-        return obj._get_forum_latest_post.time
+    def lastmod(self, obj):
+        return obj.last_activity
 
 
-class ThreadSitemap(Sitemap):
+class ThreadSitemap(StreamingSitemap):
     changefreq = 'daily'
+    generation = 'threads'
 
     def items(self):
-        return Thread.objects.all()
+        return Thread.objects.values_list('pk', 'forum__slug', 'slug', 'latest_post__submit_date')
 
-    def last_mod(self, obj):
-        return obj.latest_post_time
+    def location(self, item):
+        return reverse('forum_view_thread', args=[item[1], item[2]])
 
 
-class PostSitemap(Sitemap):
+class PostSitemap(StreamingSitemap):
     changefreq = 'weekly'
+    generation = 'posts'
 
     def items(self):
-        return Post.objects.all()
+        return get_comment_model().objects.filter(content_type_id=thread_content_type_id()).values_list(
+            'pk', 'content_type_id', 'object_pk', 'submit_date')
+
+    def location(self, item):
+        # Comment.get_absolute_url without loading the comment.
+        return '%s#c%s' % (reverse('comments-url-redirect', args=(item[1], item[2])), item[0])
+
+
+def sitemap(request, sitemaps, section=None, **kwargs):
+    """
+    django.contrib.sitemaps.views.sitemap, caching each rendered section
+    under the generations of its threads or posts.
+    """
+    cache = get_forum_cache()
+    page = request.GET.get('p', '1')
+    generation = getattr(sitemaps.get(section), 'generation', None)
+    if not cache or not generation or not page.isdigit():
+        return views.sitemap(request, sitemaps, section, **kwargs)
 
-    def last_mod(self, obj):
-        return obj.time
+    key = 'forum::sitemap::%s::%s::%s::%s:%s' % (
+        request.scheme, generation, page, get_generation('forums'),
+        get_generation('sitemap::%s::%s' % (generation, page)))
+    response = cache.get(key)
+    if response is None:
+        response = views.sitemap(request, sitemaps, section, **kwargs)
+        response.add_post_render_callback(
+            lambda r: cache.set(key, r, FORUM_SITEMAP_CACHE_TIMEOUT))
+    return response
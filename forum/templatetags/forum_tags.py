@@ -1,99 +1,197 @@
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.template import Library, Node, TemplateSyntaxError, Variable
-from forum.models import Thread
-import django_comments
+from forum import activity
+from forum.models import Thread, get_forum_cache, get_generation
+from forum.permissions import get_permissions
+from forum.registry import get_comment_model, thread_content_type_id
 
 register = Library()
-Post = django_comments.get_model()
+Post = get_comment_model()
+
+FORUM_TAG_CACHE_TIMEOUT = getattr(settings, 'FORUM_TAG_CACHE_TIMEOUT', 60*5)
+
+# Hits and misses of the tag cache in this process, by tag name.
+tag_cache_stats = Counter()
+
+
+def split_as(bits, context_var):
+    """ Strips a trailing "as [context_var]" from bits. """
+    if len(bits) > 2 and bits[-2] == 'as':
+        return bits[:-2], bits[-1]
+    return bits, context_var
+
+
+def viewer_permissions(context):
+    return get_permissions(context.get('user') or AnonymousUser())
+
+
+def visibility_class(permissions):
+    """
+    Names the set of forums permissions can read. Users of the same
+    class, granted the same restricted forums, see the same tag results.
+    Staff are no exception: restricted forums need allowed_users for them too.
+    """
+    if permissions.is_staff:
+        name = 'staff'
+    elif permissions.is_upgraded:
+        name = 'upgraded'
+    else:
+        name = 'user' if permissions.is_authenticated else 'anonymous'
+    if permissions.allowed_forum_ids:
+        ids = ','.join(str(pk) for pk in sorted(permissions.allowed_forum_ids))
+        name = '%s-%s' % (name, hashlib.md5(ids.encode('utf-8')).hexdigest())
+    return name
+
+
+def cached_result(name, args, generations, permissions, compute):
+    """
+    The result of compute(), cached for FORUM_TAG_CACHE_TIMEOUT seconds
+    per args and visibility class, and until one of generations is bumped
+    (see invalidate_tags in forum.models).
+    """
+    cache = get_forum_cache()
+    if not cache or not FORUM_TAG_CACHE_TIMEOUT:
+        return compute()
+    key = 'forum::tag::%s::%s::%s::%s' % (
+        name, args, visibility_class(permissions),
+        ':'.join(str(get_generation(generation)) for generation in generations))
+    result = cache.get(key)
+    if result is None:
+        tag_cache_stats['%s.misses' % name] += 1
+        result = compute()
+        cache.set(key, result, FORUM_TAG_CACHE_TIMEOUT)
+    else:
+        tag_cache_stats['%s.hits' % name] += 1
+    return result
+
+
+def get_tag_cache_stats():
+    return dict(tag_cache_stats)
 
 
 def forum_latest_thread_activity(parser, token):
     """
     {% forum_latest_thread_activity [number] as [context_var] %}
     """
-    bits = token.contents.split()
-    if len(bits) not in (1, 2, 4):
-        raise TemplateSyntaxError('%s tag requires none, one or three arguments' % bits[0])
-    if bits[2] != 'as':
-        raise TemplateSyntaxError("Second argument to %s tag must be 'as'" % bits[0])
-    if not bits[1]:
-        bits[1] = 5 # Default number of items
-    if not bits[3]:
-        bits[3] = 'latest_thread_activity'
-    return ForumLatestThreadsNode(bits[1], bits[3])
+    bits, context_var = split_as(token.contents.split(), 'latest_thread_activity')
+    if len(bits) not in (1, 2):
+        raise TemplateSyntaxError("%s tag requires a number and 'as [context_var]'" % bits[0])
+    number = bits[1] if len(bits) == 2 else 5 # Default number of items
+    return ForumLatestThreadsNode(number, context_var)
 
 class ForumLatestThreadsNode(Node):
+    """
+    Reads the site-wide "latest-threads" activity list. Twice the number
+    of threads asked for are fetched, in one query, so that some can be
+    dropped for being in forums the viewer cannot read.
+    """
     def __init__(self, number, context_var):
-        self.number = int(number) - 1
+        self.number = int(number)
         self.context_var = context_var
     
     def render(self, context):
-        context[self.context_var] = Thread.objects.select_related().order_by('-latest_post_time')[:self.number]
+        permissions = viewer_permissions(context)
+
+        def compute():
+            threads = activity.get_objects(
+                'latest-threads', Thread.objects.select_related('forum', 'latest_post'), self.number * 2)
+            return [thread for thread in threads if permissions.can_read(thread.forum)][:self.number]
+        context[self.context_var] = cached_result(
+            'latest_thread_activity', self.number, ['tags'], permissions, compute)
         return ''
 
 def forum_latest_posts(parser, token):
     """
     {% forum_latest_posts [number] as [context_var] %}
     """
-    bits = token.contents.split()
-    if len(bits) not in (1, 2, 4):
-        raise TemplateSyntaxError('%s tag requires none, one or three arguments' % bits[0])
-    if bits[2] != 'as':
-        raise TemplateSyntaxError("Second argument to %s tag must be 'as'" % bits[0])
-    if not bits[1]:
-        bits[1] = 5 # Default number of items
-    if not bits[3]:
-        bits[3] = 'latest_posts'
-    return ForumLatestPostsNode(bits[1], bits[3])
+    bits, context_var = split_as(token.contents.split(), 'latest_posts')
+    if len(bits) not in (1, 2):
+        raise TemplateSyntaxError("%s tag requires a number and 'as [context_var]'" % bits[0])
+    number = bits[1] if len(bits) == 2 else 5 # Default number of items
+    return ForumLatestPostsNode(number, context_var)
 
 class ForumLatestPostsNode(Node):
+    """
+    Reads the site-wide "latest-posts" activity list, filtered like
+    ForumLatestThreadsNode.
+    """
     def __init__(self, number, context_var):
-        self.number = int(number) - 1
+        self.number = int(number)
         self.context_var = context_var
     
     def render(self, context):
-        context[self.context_var] = Post.objects.select_related().order_by('-time')[:self.number]
+        permissions = viewer_permissions(context)
+
+        def compute():
+            posts = activity.get_objects('latest-posts', visible_posts(), self.number * 2)
+            return readable_posts(posts, permissions)[:self.number]
+        context[self.context_var] = cached_result(
+            'latest_posts', self.number, ['tags'], permissions, compute)
         return ''
 
 
+def visible_posts():
+    return Post.objects.filter(is_public=True, is_removed=False,
+                               content_type_id=thread_content_type_id()).select_related('user')
+
+
+def readable_posts(posts, permissions):
+    """
+    The posts whose forum permissions can read. Their threads are looked
+    up by object_pk in one query, so ThreadPost need not be backfilled.
+    """
+    threads = Thread.objects.select_related('forum').in_bulk(set(int(post.object_pk) for post in posts))
+    return [post for post in posts if int(post.object_pk) in threads and
+            permissions.can_read(threads[int(post.object_pk)].forum)]
+
+
 def forum_latest_user_posts(parser, token):
     """
     {% forum_latest_user_posts user [number] as [context_var] %}
     """
-    bits = token.contents.split()
-    if len(bits) not in (2, 3, 5):
-        raise TemplateSyntaxError('%s tag requires one, two or four arguments' % bits[0])
-    if bits[3] != 'as':
-        raise TemplateSyntaxError("Second argument to %s tag must be 'as'" % bits[0])
-    if not bits[2]:
-        bits[2] = 5 # Default number of items
-    if not bits[3]:
-        bits[4] = 'latest_user_posts'
-    return ForumLatestUserPostsNode(bits[1], bits[2], bits[4])
+    bits, context_var = split_as(token.contents.split(), 'latest_user_posts')
+    if len(bits) not in (2, 3):
+        raise TemplateSyntaxError("%s tag requires a user, a number and 'as [context_var]'" % bits[0])
+    number = bits[2] if len(bits) == 3 else 5 # Default number of items
+    return ForumLatestUserPostsNode(bits[1], number, context_var)
 
 class ForumLatestUserPostsNode(Node):
+    """
+    Reads the user's capped "user-<pk>-latest-posts" activity list, which
+    update_thread and the thread view keep current, and fetches the posts
+    with one query. Posts in forums the viewer cannot read are left out.
+    """
     def __init__(self, user, number, context_var):
         self.user = Variable(user)
-        self.number = int(number) - 1
+        self.number = int(number)
         self.context_var = context_var
     
     def render(self, context):
         user = self.user.resolve(context)
-        context[self.context_var] = Post.objects.select_related().filter(author=user).order_by('-time')[:self.number]
+        permissions = viewer_permissions(context)
+
+        def compute():
+            posts = activity.get_objects('user-%s-latest-posts' % user.pk, visible_posts(), self.number)
+            return readable_posts(posts, permissions)
+        # 'tags' is bumped when forums or threads change, which may hide posts.
+        context[self.context_var] = cached_result(
+            'latest_user_posts', '%s:%s' % (user.pk, self.number), ['tags', 'tags::user::%s' % user.pk],
+            permissions, compute)
         return ''
 
 
 @register.filter(name='can_post_in')
 def can_post_in(user, forum):
-    if forum.only_staff_posts:
-        return user.is_authenticated and user.is_staff
-    return user.is_authenticated
+    return get_permissions(user).can_post(forum)
 
 
 @register.filter(name='can_read_in')
 def can_read_in(user, forum):
-    if forum.only_staff_reads:
-        return user.is_authenticated and user.is_staff
-    return True
+    return get_permissions(user).can_read(forum)
 
 register.tag('forum_latest_posts', forum_latest_posts)
 register.tag('forum_latest_thread_activity', forum_latest_thread_activity)
@@ -0,0 +1,202 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django_comments.signals import comment_was_posted
+
+from forum import activity
+from forum.models import Category, Forum, Thread
+from forum.registry import get_comment_model, thread_content_type_id
+from forum.views import ForumList
+
+
+def make_forum(slug, **kwargs):
+    # Forum.save() takes no arguments, so Forum.objects.create() cannot be used.
+    forum = Forum(title=slug, slug=slug, description=slug, site=Site.objects.get_current(), **kwargs)
+    forum.save()
+    return forum
+
+
+def make_post(thread, user=None):
+    return get_comment_model().objects.create(
+        content_type_id=thread_content_type_id(), object_pk=str(thread.pk),
+        site=Site.objects.get_current(), user=user, user_name='' if user else 'guest',
+        comment='post', submit_date=timezone.now())
+
+
+class UpdateThreadTest(TransactionTestCase):
+    # Keeps the sites and content types rows, whose ids are cached.
+    serialized_rollback = True
+
+    def reply(self, post, errors):
+        try:
+            comment_was_posted.send(sender=get_comment_model(), comment=post, request=None)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_interleaved_replies(self):
+        """ A reply counted between another reply's read and write is kept. """
+        forum = make_forum('interleaved')
+        thread = Thread.objects.create(forum=forum, title='interleaved')
+        first, second = make_post(thread), make_post(thread)
+        get, raced = QuerySet.get, []
+
+        def racing_get(queryset, *args, **kwargs):
+            obj = get(queryset, *args, **kwargs)
+            if queryset.model is Thread and not raced:
+                # The second reply completes while the first holds a stale thread.
+                raced.append(True)
+                comment_was_posted.send(sender=get_comment_model(), comment=second, request=None)
+            return obj
+
+        with mock.patch.object(QuerySet, 'get', racing_get):
+            comment_was_posted.send(sender=get_comment_model(), comment=first, request=None)
+
+        thread.refresh_from_db()
+        forum.refresh_from_db()
+        self.assertEqual(raced, [True])
+        self.assertEqual(thread.posts, 2)
+        self.assertEqual(thread.latest_post_id, second.pk)
+        self.assertEqual(forum.post_count, 2)
+        self.assertEqual(forum.latest_post_id, second.pk)
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_concurrent_replies(self):
+        """ Simultaneous replies each count once and latest_post is the newest. """
+        forum = make_forum('concurrent')
+        thread = Thread.objects.create(forum=forum, title='concurrent')
+        posts = [make_post(thread) for i in range(20)]
+
+        errors = []
+        workers = [threading.Thread(target=self.reply, args=(post, errors)) for post in posts]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        thread.refresh_from_db()
+        forum.refresh_from_db()
+        self.assertEqual(thread.posts, 20)
+        self.assertEqual(thread.latest_post_id, posts[-1].pk)
+        self.assertEqual(forum.post_count, 20)
+        self.assertEqual(forum.subtree_post_count, 20)
+        self.assertEqual(forum.latest_post_id, posts[-1].pk)
+
+    def test_replies_update_ancestors(self):
+        parent = make_forum('parent')
+        child = make_forum('child', parent=parent)
+        thread = Thread.objects.create(forum=child, title='nested')
+        posts = [make_post(thread) for i in range(3)]
+        for post in posts:
+            comment_was_posted.send(sender=get_comment_model(), comment=post, request=None)
+
+        parent.refresh_from_db()
+        self.assertEqual(parent.post_count, 0)
+        self.assertEqual(parent.subtree_post_count, 3)
+        self.assertEqual(parent.latest_post_id, posts[-1].pk)
+        self.assertEqual(parent.latest_thread_id, thread.pk)
+
+
+class ForumListQueriesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='x')
+        self.category = Category.objects.create(title='General', slug='general', description='')
+
+    def add_forums(self, prefix, count):
+        for i in range(count):
+            forum = make_forum('%s-%s' % (prefix, i), category=self.category)
+            make_forum('%s-%s-child' % (prefix, i), parent=forum)
+            # Restricted forums at three depths, each linked by its full path.
+            parent = None
+            for depth in range(3):
+                parent = make_forum('%s-%s-restricted-%s' % (prefix, i, depth), parent=parent,
+                                    restricted=True)
+                parent.allowed_users.add(self.user)
+            thread = Thread.objects.create(forum=forum, title='%s %s' % (prefix, i))
+            comment_was_posted.send(sender=get_comment_model(), comment=make_post(thread, self.user),
+                                    request=None)
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        return request
+
+    def evaluate_context(self, request):
+        """ Builds the ForumList context and renders each forum's row. """
+        context = ForumList.as_view()(request).context_data
+        for forum in list(context['object_list']) + list(context['restricted_forums']):
+            render_to_string('forum/forum_list_item.html', {'forum': forum})
+            list(forum.child.all())
+        for category in context['categories']:
+            list(category.forum_set.all())
+
+    def test_constant_queries(self):
+        self.add_forums('a', 2)
+        request = self.request()
+        with CaptureQueriesContext(connection) as queries:
+            self.evaluate_context(request)
+        self.add_forums('b', 5)
+        request = self.request()
+        with self.assertNumQueries(len(queries)):
+            self.evaluate_context(request)
+
+
+class ActivityTest(TestCase):
+    def setUp(self):
+        activity._backend[:] = [activity.LocMemActivityList()]
+        self.forum = make_forum('activity')
+
+    def tearDown(self):
+        del activity._backend[:]
+
+    def test_get_objects_single_query(self):
+        threads = [Thread.objects.create(forum=self.forum, title='t%s' % i) for i in range(5)]
+        for thread in threads:
+            activity.push('test-list', thread.pk, trim=3)
+        activity.push('test-list', threads[0].pk, trim=3)
+
+        with self.assertNumQueries(1):
+            listed = activity.get_objects('test-list', Thread.objects.all(), 10)
+        self.assertEqual([t.pk for t in listed], [threads[0].pk, threads[4].pk, threads[3].pk])
+
+    def test_get_objects_skips_missing(self):
+        threads = [Thread.objects.create(forum=self.forum, title='t%s' % i) for i in range(2)]
+        for thread in threads:
+            activity.push('test-list', thread.pk, trim=10)
+        threads[1].delete()
+        self.assertEqual(activity.get_objects('test-list', Thread.objects.all(), 10), [threads[0]])
+
+    def test_get_objects_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(activity.get_objects('missing', Thread.objects.all(), 10), [])
+
+
+class ThreadMoveTest(TestCase):
+    def test_move_between_siblings(self):
+        """ A thread moved between two children counts once in their parent. """
+        root = make_forum('root')
+        first, second = make_forum('first', parent=root), make_forum('second', parent=root)
+        thread = Thread.objects.create(forum=first, title='moved')
+        comment_was_posted.send(sender=get_comment_model(), comment=make_post(thread), request=None)
+
+        thread = Thread.objects.get(pk=thread.pk)
+        thread.forum = second
+        thread.save()
+
+        root.refresh_from_db()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((root.subtree_thread_count, root.subtree_post_count), (1, 1))
+        self.assertEqual((first.thread_count, first.subtree_post_count, first.latest_thread_id), (0, 0, None))
+        self.assertEqual((second.thread_count, second.post_count, second.latest_thread_id), (1, 1, thread.pk))
@@ -11,49 +11,65 @@ from django.http import Http404, HttpResponseRedirect, HttpResponseForbidden
 from django.template import RequestContext
 from django.views.generic.list import ListView
 from django.contrib import messages
-from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch
 from django.conf import settings
+from forum import activity
 from forum.signals import thread_created
 
-try:
-    from django.contrib import comments
-except ImportError:
-    import django_comments as comments
-
-from forum.models import Forum, Thread, Category, get_forum_cache
+from forum.models import Forum, Thread, Category, get_forum_cache, invalidate_tags, thread_posts, thread_view_counter
 from forum.forms import ThreadForm, ReplyForm
+from forum.pagecache import AnonymousPageCacheMixin
+from forum.pagination import KeysetPaginationMixin
+from forum.permissions import get_permissions
+from forum.registry import get_comment_model
 
 
 FORUM_PAGINATION = getattr(settings, 'FORUM_PAGINATION', 20)
 LOGIN_URL = getattr(settings, 'LOGIN_URL', '/accounts/login/')
 FORUM_FLOOD_CONTROL = getattr(settings, 'FORUM_FLOOD_CONTROL', {})
 FORUM_POST_EXPIRE_IN = getattr(settings, 'FORUM_POST_EXPIRE_IN', 0)
+FORUM_COUNT_VIEWS = getattr(settings, 'FORUM_COUNT_VIEWS', True)
+FORUM_MAX_STICKY_THREADS = getattr(settings, 'FORUM_MAX_STICKY_THREADS', 20)
+
 
+class ForumList(AnonymousPageCacheMixin, ListView):
+    def get_page_generations(self):
+        return ['index']
 
-class ForumList(ListView):
     def get_queryset(self):
-        return Forum.objects.for_user(
-            self.request.user).filter(restricted=False, parent__isnull=True, site=settings.SITE_ID)
+        return Forum.objects.for_user(self.request.user).filter(
+            restricted=False, parent__isnull=True, site=settings.SITE_ID).select_related(
+            'latest_post__user').prefetch_related('child')
 
     def get_context_data(self, **kwargs):
         context = super(ForumList, self).get_context_data(**kwargs)
-        user = self.request.user
-        if user.is_authenticated and hasattr(user, 'userprofile') and getattr(user.userprofile, 'is_upgraded', False):
+        permissions = get_permissions(self.request.user)
+        if permissions.is_upgraded:
             categories = Category.objects.all()
         else:
             categories = Category.objects.filter(only_upgraders=False)
-        context['categories'] = categories
+        context['categories'] = categories.prefetch_related(
+            Prefetch('forum_set', queryset=Forum.objects.for_user(self.request.user)))
+
         if self.request.user.is_authenticated:
-            context['restricted_forums'] = [i.forum for i in Forum.allowed_users.through.objects.filter(
-                user=self.request.user)]
-        for item in self.get_queryset():
+            # Restricted forums may be nested; their URLs need their ancestors.
+            context['restricted_forums'] = Forum.objects.prefetch_ancestors(Forum.objects.filter(
+                pk__in=permissions.allowed_forum_ids).select_related(
+                'latest_post__user').prefetch_related('child'))
+
+        # The template iterates the same, already evaluated, result cache.
+        for item in context['object_list']:
             context["%s_forum" % item.slug.replace('-', '_')] = item
         return context
 
 
-class ThreadList(ListView):
+class ThreadList(AnonymousPageCacheMixin, KeysetPaginationMixin, ListView):
     template_object_name = 'thread',
     paginate_by = FORUM_PAGINATION
+    keyset_fields = ('-id',)
+
+    def get_page_generations(self):
+        return ['forum::%s' % self.kwargs.get('slug')]
 
     def get_template_names(self):
         return [
@@ -61,16 +77,22 @@ class ThreadList(ListView):
             'forum/thread_list.html',
         ]
 
-    def get_queryset(self, sticky=False):
-        try:
-            self.forum = Forum.objects.for_user(
-                self.request.user).select_related().get(slug=self.kwargs.get('slug'), site=settings.SITE_ID)
-            if self.forum.restricted:
-                if not self.request.user.is_authenticated or self.request.user not in self.forum.allowed_users.all():
-                    raise Http404
-        except Forum.DoesNotExist:
-            raise Http404
-        return self.forum.thread_set.filter(sticky=sticky)
+    def get_forum(self):
+        if not hasattr(self, 'forum'):
+            try:
+                self.forum = Forum.objects.get(slug=self.kwargs.get('slug'), site=settings.SITE_ID)
+            except Forum.DoesNotExist:
+                raise Http404
+            if not get_permissions(self.request.user).can_read(self.forum):
+                raise Http404
+        return self.forum
+
+    def get_queryset(self):
+        # thread_set hands self.forum to every row, so t.forum costs nothing.
+        return self.get_forum().thread_set.filter(sticky=False).select_related('latest_post')
+
+    def get_estimated_count(self):
+        return self.forum.thread_count
 
     def get_context_data(self, **kwargs):
         context = super(ThreadList, self).get_context_data(**kwargs)
@@ -90,9 +112,12 @@ class ThreadList(ListView):
                 expire_date = datetime.fromtimestamp(expire_date)
                 form = None
 
-        recent_threads = [i for i in self.get_queryset()[:30] if i.posts > 0][:10]
-        active_threads = Thread.nonrel_objects.get_list("%s-latest-threads" % self.forum.slug, limit=10)
-        sticky_threads = self.get_queryset(sticky=True)
+        # Each list is capped on its own, both are index range scans on
+        # (forum, sticky, -id).
+        threads = self.forum.thread_set.select_related('latest_post').order_by('-id')
+        sticky_threads = list(threads.filter(sticky=True)[:FORUM_MAX_STICKY_THREADS])
+        recent_threads = list(threads.filter(sticky=False, posts__gt=0)[:10])
+        active_threads = self.forum.latest_threads(limit=10)
         context.update({
             'forum': self.forum,
             'active_threads': active_threads,
@@ -106,10 +131,21 @@ class ThreadList(ListView):
         return context
 
 
-class PostList(ListView):
+class PostList(AnonymousPageCacheMixin, KeysetPaginationMixin, ListView):
     template_object_name = 'post'
     paginate_by = FORUM_PAGINATION
-    model = comments.get_model()
+    model = get_comment_model()
+    keyset_fields = ('submit_date', 'id')
+
+    def get_page_generations(self):
+        return ['thread::%s' % self.kwargs.get('thread')]
+
+    def get_page_cache_extra(self):
+        return self.object.pk
+
+    def page_cache_hit(self, thread_pk):
+        if FORUM_COUNT_VIEWS:
+            thread_view_counter.incr(thread_pk)
 
     def get_template_names(self):
         return [
@@ -121,16 +157,19 @@ class PostList(ListView):
         re = super(PostList, self).get(*args, **kwargs)
         if self.object.forum.slug != self.kwargs.get('forum'):
             return HttpResponseRedirect(self.object.get_absolute_url())
+        if FORUM_COUNT_VIEWS:
+            thread_view_counter.incr(self.object.pk)
         return re
 
     def get_queryset(self, **kwargs):
         self.object = get_object_or_404(Thread, slug=self.kwargs.get('thread'), forum__site=settings.SITE_ID)
-        if not Forum.objects.has_access(self.object.forum, self.request.user):
+        if not get_permissions(self.request.user).can_read(self.object.forum):
             raise Http404
-        Post = comments.get_model()
-        return Post.objects.filter(
-            content_type=ContentType.objects.get_for_model(Thread),
-            object_pk=self.object.pk).order_by('submit_date')
+        return thread_posts(self.object)
+
+    def get_estimated_count(self):
+        # The opening post is not counted in Thread.posts.
+        return self.object.posts + 1
 
     def get_context_data(self, **kwargs):
         context = super(PostList, self).get_context_data(**kwargs)
@@ -142,9 +181,12 @@ class PostList(ListView):
             initial = {'subscribe': False}
 
         form = None
-        if self.request.user.is_authenticated and self.request.user not in self.object.banned_users.all():
+        if get_permissions(self.request.user).can_reply(self.object):
             form = ReplyForm(initial=initial)
 
+        # Show the views that are still buffered in this process.
+        self.object.views += thread_view_counter.pending(self.object.pk)
+
         context.update({
             'thread': self.object,
             'forum': self.object.forum,
@@ -175,18 +217,7 @@ def thread(request, forum, thread=None):
                                      forum__site=settings.SITE_ID)
     f_instance = get_object_or_404(Forum, slug=forum, site=settings.SITE_ID)
 
-    def can_post(forum, user):
-        if forum.only_staff_posts:
-            return user.is_authenticated and user.is_staff
-        if forum.only_upgraders:
-            return user.is_authenticated and (user.is_staff or (hasattr(user, 'userprofile') and
-                                                                getattr(user.userprofile, 'is_upgraded', False)))
-        return user.is_authenticated
-
-    if not can_post(f_instance, request.user):
-        return HttpResponseForbidden()
-
-    if not Forum.objects.has_access(f_instance, request.user):
+    if not get_permissions(request.user).can_post(f_instance):
         return HttpResponseForbidden()
 
     if not request.user.is_authenticated:
@@ -230,7 +261,11 @@ def thread(request, forum, thread=None):
                     return HttpResponseRedirect(post_url)
         instance = form.save()
         if not thread:
-            Thread.nonrel_objects.push_to_list('%s-latest-comments' % f_instance.slug, instance, trim=30)
+            activity.push('%s-latest-comments' % f_instance.slug, instance.pk, trim=30)
+            activity.push('latest-threads', instance.pk, trim=50)
+            activity.push('latest-posts', instance.comment_id, trim=50)
+            activity.push('user-%s-latest-posts' % request.user.pk, instance.comment_id, trim=20)
+            invalidate_tags(request.user.pk)
             thread_created.send(sender=Thread, instance=instance, author=request.user)
         return HttpResponseRedirect(instance.get_absolute_url())
 